@@ -72,6 +72,20 @@ _CINDER_OPTS = [
     cfg.BoolOpt('cinder_api_insecure',
                 default=False,
                 help=_('Allow to perform insecure SSL requests to cinder')),
+    cfg.FloatOpt('cinder_volume_growth_factor',
+                 default=2.0,
+                 help=_('When the size of an image being uploaded is not '
+                        'known, the volume is extended by this factor each '
+                        'time the data written reaches its end. Volumes '
+                        'cannot be shrunk, so the space extended by is left '
+                        'unused past the end of the image. If value <= 1, '
+                        'the volume is extended by 1 GB at a time.')),
+    cfg.IntOpt('cinder_volume_max_growth',
+               default=16,
+               help=_('The largest amount, in GB, by which a volume of '
+                      'unknown size is extended at once while an image is '
+                      'uploaded to it. This bounds the space left unused '
+                      'past the end of the image.')),
     cfg.StrOpt('cinder_store_auth_address',
                default=None,
                help=_('The address where the Cinder authentication service '
@@ -399,8 +413,9 @@ class Store(glance_store.driver.Store):
             self._check_context(context)
             volume = get_cinderclient(self.conf,
                                       context).volumes.get(loc.volume_id)
-            # GB unit convert to byte
-            return volume.size * units.Gi
+            # The volume may be larger than the image it holds
+            return int(volume.metadata.get('image_size',
+                                           volume.size * units.Gi))
         except cinder_exception.NotFound:
             raise exceptions.NotFound(image=loc.volume_id)
         except Exception:
@@ -444,9 +459,9 @@ class Store(glance_store.driver.Store):
         LOG.debug('Creating a new volume: image_size=%d size_gb=%d',
                   image_size, size_gb)
         if image_size == 0:
-            LOG.info(_LI("Since image size is zero, we will be doing "
-                         "resize-before-write for each GB which "
-                         "will be considerably slower than normal."))
+            LOG.info(_LI("Since image size is zero, we will be extending "
+                         "the volume while writing it, which will be "
+                         "slower than normal."))
         volume = client.volumes.create(size_gb, name=name, metadata=metadata)
         volume = self._wait_volume_status(volume, 'creating', 'available')
 
@@ -475,7 +490,7 @@ class Store(glance_store.driver.Store):
                         bytes_written += len(buf)
 
                 if need_extend:
-                    size_gb += 1
+                    size_gb = self._grow_size_gb(size_gb)
                     LOG.debug("Extending volume %(volume_id)s to %(size)s GB.",
                               {'volume_id': volume.id, 'size': size_gb})
                     volume.extend(volume, size_gb)
@@ -519,6 +534,15 @@ class Store(glance_store.driver.Store):
 
         return ('cinder://%s' % volume.id, bytes_written, checksum_hex, {})
 
+    def _grow_size_gb(self, size_gb):
+        """
+        Returns the size, in GB, to extend a volume of unknown size to.
+        """
+        growth_factor = self.conf.glance_store.cinder_volume_growth_factor
+        max_growth = self.conf.glance_store.cinder_volume_max_growth
+        step = int(size_gb * (growth_factor - 1))
+        return size_gb + max(min(step, max_growth), 1)
+
     @capabilities.check
     def delete(self, location, context=None):
         """
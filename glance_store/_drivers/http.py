@@ -13,16 +13,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import logging
+import threading
+import time
 
 from oslo_config import cfg
 from oslo_utils import encodeutils
+from oslo_utils import units
 
 from six.moves import urllib
 
 import requests
 
 from glance_store import capabilities
+from glance_store.common import utils
 import glance_store.driver
 from glance_store import exceptions
 from glance_store.i18n import _
@@ -32,6 +37,12 @@ LOG = logging.getLogger(__name__)
 
 
 MAX_REDIRECTS = 5
+DEFAULT_RETRY_GET_BACKOFF = 0.5
+DEFAULT_DOWNLOAD_RANGE_SIZE = 16
+DEFAULT_POOL_SIZE = 10
+MAX_SESSIONS = 32
+DEFAULT_URL_CACHE_TTL = 300
+URL_CACHE_SIZE = 1024
 
 _HTTP_OPTS = [
     cfg.StrOpt('https_ca_certificates_file',
@@ -51,7 +62,53 @@ _HTTP_OPTS = [
                        'scheme and proxy. e.g. http:10.0.0.1:3128. You can '
                        'specify proxies for multiple schemes by seperating '
                        'the key value pairs with a comma.'
-                       'e.g. http:10.0.0.1:3128, https:10.0.0.1:1080.'))]
+                       'e.g. http:10.0.0.1:3128, https:10.0.0.1:1080.')),
+    cfg.IntOpt('http_retry_get_count',
+               default=0,
+               help=_('The number of times a download from the http store '
+                      'is resumed after the connection to the remote server '
+                      'broke, before the download fails.')),
+    cfg.FloatOpt('http_retry_get_backoff',
+                 default=DEFAULT_RETRY_GET_BACKOFF,
+                 help=_('The base delay, in seconds, before resuming a '
+                        'download from the http store. The delay doubles '
+                        'with every retry, up to 30 seconds, and a random '
+                        'part of it is used.')),
+    cfg.IntOpt('http_download_concurrency',
+               default=1,
+               help=_('The number of byte ranges of an image that are '
+                      'downloaded concurrently from a remote server which '
+                      'accepts ranges, each over a connection of its own. '
+                      'Ranges are buffered in memory until they are returned '
+                      'in order, so up to this many times '
+                      'http_download_range_size of memory may be used per '
+                      'download. The default of 1 streams the image with a '
+                      'single request.')),
+    cfg.IntOpt('http_download_range_size',
+               default=DEFAULT_DOWNLOAD_RANGE_SIZE,
+               help=_('The size, in MB, of the byte ranges requested when '
+                      'http_download_concurrency is greater than 1.')),
+    cfg.IntOpt('http_pool_size',
+               default=DEFAULT_POOL_SIZE,
+               help=_('The maximum number of connections to a remote server '
+                      'that are kept open for reuse. One pool is kept for '
+                      'each scheme, host, CA bundle and proxy. It should be '
+                      'at least http_download_concurrency.')),
+    cfg.BoolOpt('http_keep_alive',
+                default=True,
+                help=_('If true, connections to remote servers are kept '
+                       'open and reused for later requests. If false, '
+                       'every request uses a new connection.')),
+    cfg.IntOpt('http_url_cache_ttl',
+               default=DEFAULT_URL_CACHE_TTL,
+               help=_('The number of seconds for which the URL an image '
+                      'location redirects to, and the size of the image, '
+                      'are remembered. Requests for the image go straight '
+                      'to that URL, and the size is returned without a '
+                      'request. After that the size is revalidated with the '
+                      'ETag or Last-Modified header of the image. Set to 0 '
+                      'to follow redirects and get the size on every '
+                      'request.'))]
 
 
 class StoreLocation(glance_store.location.StoreLocation):
@@ -125,31 +182,73 @@ class StoreLocation(glance_store.location.StoreLocation):
         self.path = path
 
 
-def http_response_iterator(conn, response, size):
+class SessionPool(object):
     """
-    Return an iterator for a file-like object.
+    A thread-safe pool of requests sessions, one per remote endpoint.
 
-    :param conn: HTTP(S) Connection
-    :param response: urllib3.HTTPResponse object
-    :param size: Chunk size to iterate with
+    Sessions are keyed by scheme, host, certificate verification and proxy,
+    which are set once when the session is created and never changed, so
+    concurrent requests cannot see each other's settings. The least recently
+    used session is closed once more than ``max_sessions`` are open.
     """
-    try:
-        chunk = response.read(size)
-        while chunk:
-            yield chunk
-            chunk = response.read(size)
-    finally:
-        conn.close()
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.hits = 0
+        self.misses = 0
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """Return the session for `key`, creating it with `factory`."""
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                LOG.debug("Creating HTTP session for %(scheme)s://%(host)s "
+                          "(%(hits)d hits, %(misses)d misses)",
+                          {'scheme': key[0], 'host': key[1],
+                           'hits': self.hits, 'misses': self.misses})
+                session = factory()
+            # Mark the session as the most recently used one
+            self._sessions[key] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)[1].close()
+            return session
+
+    def clear(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
 
 
 class Store(glance_store.driver.Store):
 
     """An implementation of the HTTP(S) Backend Adapter"""
 
-    _CAPABILITIES = (capabilities.BitMasks.READ_ACCESS |
+    _CAPABILITIES = (capabilities.BitMasks.READ_RANDOM |
                      capabilities.BitMasks.DRIVER_REUSABLE)
     OPTIONS = _HTTP_OPTS
 
+    def __init__(self, conf):
+        super(Store, self).__init__(conf)
+        self.sessions = SessionPool()
+
+    def configure(self, re_raise_bsc=False):
+        ttl = self.url_cache_ttl = self.conf.glance_store.http_url_cache_ttl
+        self._redirects = utils.ExpiringCache(ttl, max_size=URL_CACHE_SIZE)
+        # NOTE: Sizes older than the TTL are revalidated rather than dropped,
+        # so they are kept until they are evicted.
+        self._sizes = utils.ExpiringCache(ttl if ttl <= 0 else float('inf'),
+                                          max_size=URL_CACHE_SIZE)
+        super(Store, self).configure(re_raise_bsc=re_raise_bsc)
+
     @capabilities.check
     def get(self, location, offset=0, chunk_size=None, context=None):
         """
@@ -159,16 +258,15 @@ class Store(glance_store.driver.Store):
 
         :param location: `glance_store.location.Location` object, supplied
                         from glance_store.location.get_location_from_uri()
+        :param offset: offset to start reading
+        :param chunk_size: size to read, or None to get all the image
         """
-        try:
-            conn, resp, content_length = self._query(location, 'GET')
-        except requests.exceptions.ConnectionError:
-            reason = _("Remote server where the image is present "
-                       "is unavailable.")
-            LOG.exception(reason)
-            raise exceptions.RemoteServiceUnavailable(message=reason)
-
-        iterator = http_response_iterator(conn, resp, self.READ_CHUNKSIZE)
+        if self.conf.glance_store.http_download_concurrency > 1:
+            iterator, content_length = self._get_ranged(location, offset,
+                                                        chunk_size)
+        else:
+            iterator, content_length = self._get_stream(location, offset,
+                                                        chunk_size)
 
         class ResponseIndexable(glance_store.Indexable):
             def another(self):
@@ -179,6 +277,134 @@ class Store(glance_store.driver.Store):
 
         return (ResponseIndexable(iterator, content_length), content_length)
 
+    def _get_stream(self, location, offset=0, chunk_size=None):
+        """Start a download of an image, or part of it, as one response.
+
+        :returns: tuple of (iterator over the image data, data size)
+        """
+        headers = None
+        if offset or chunk_size is not None:
+            headers = {'Range': utils.get_range_header(offset, chunk_size)}
+
+        try:
+            conn, resp, content_length = self._query(location, 'GET',
+                                                     headers=headers)
+        except requests.exceptions.ConnectionError:
+            reason = _("Remote server where the image is present "
+                       "is unavailable.")
+            LOG.exception(reason)
+            raise exceptions.RemoteServiceUnavailable(message=reason)
+
+        skip = 0
+        if headers and conn.status_code != requests.codes.partial_content:
+            # NOTE: The server does not support ranges and sent the whole
+            # image, so skip to the requested offset and stop after
+            # chunk_size bytes on our side.
+            LOG.debug("HTTP server ignored Range header %s, reading the "
+                      "requested bytes from the full response",
+                      headers['Range'])
+            skip = offset
+            content_length = max(content_length - offset, 0)
+            if chunk_size is not None:
+                content_length = min(content_length, chunk_size)
+
+        iterator = self._retry_iterator(location, conn, offset=offset,
+                                        length=content_length, skip=skip)
+        return iterator, content_length
+
+    def _retry_iterator(self, location, conn, offset=0, length=0, skip=0):
+        """Return an iterator for `conn`, resuming it if it is cut short.
+
+        The read is resumed at most ``http_retry_get_count`` times, and
+        only if the image is unchanged.
+        """
+        glance_conf = self.conf.glance_store
+
+        def _query(range_header):
+            return self._query(location, 'GET',
+                               headers={'Range': range_header})[0]
+
+        return utils.http_retry_iterator(
+            _query, location.store_location.path, conn, self.READ_CHUNKSIZE,
+            glance_conf.http_retry_get_count,
+            backoff=glance_conf.http_retry_get_backoff, offset=offset,
+            length=length, skip=skip)
+
+    def _get_ranged(self, location, offset=0, chunk_size=None):
+        """Start a download of an image as byte ranges fetched concurrently.
+
+        A HEAD request tells the size of the image and whether the server
+        accepts ranges. When it does not, or when the data fits in a single
+        range of ``http_download_range_size``, the image is streamed with a
+        single request instead.
+
+        :returns: tuple of (iterator over the image data, data size)
+        """
+        conn = None
+        try:
+            conn, resp, size = self._query(location, 'HEAD')
+        except requests.exceptions.ConnectionError:
+            reason = _("Remote server where the image is present "
+                       "is unavailable.")
+            LOG.exception(reason)
+            raise exceptions.RemoteServiceUnavailable(message=reason)
+        finally:
+            if conn is not None:
+                conn.close()
+
+        end = size
+        if chunk_size is not None:
+            end = min(size, offset + chunk_size)
+        accept_ranges = conn.headers.get('accept-ranges', 'none')
+        range_size = self.conf.glance_store.http_download_range_size
+        range_size *= units.Mi
+        if accept_ranges.lower() != 'bytes' or end - offset <= range_size:
+            return self._get_stream(location, offset, chunk_size)
+
+        iterator = self._iter_ranges(location, conn.headers, offset, end,
+                                     range_size)
+        return iterator, end - offset
+
+    def _iter_ranges(self, location, headers, start, end, range_size):
+        """Return an iterator over an image from `start` to `end`.
+
+        At most ``http_download_concurrency`` ranges are fetched at once,
+        see `utils.iter_ranges`. A range cut short is resumed like a plain
+        download.
+
+        :param headers: headers of the HEAD response for the image, that
+                        every range must match
+        """
+        concurrency = self.conf.glance_store.http_download_concurrency
+
+        def _fetch(range_start, length):
+            range_header = utils.get_range_header(range_start, length)
+            try:
+                conn = self._query(location, 'GET',
+                                   headers={'Range': range_header})[0]
+            except requests.exceptions.ConnectionError:
+                reason = _("Remote server where the image is present "
+                           "is unavailable.")
+                LOG.exception(reason)
+                raise exceptions.RemoteServiceUnavailable(message=reason)
+
+            if conn.status_code != requests.codes.partial_content:
+                conn.close()
+                reason = (_("HTTP URL %(url)s did not return range "
+                            "%(range)s.") %
+                          {'url': location.store_location.path,
+                           'range': range_header})
+                LOG.error(reason)
+                raise exceptions.BackendException(reason)
+            utils.check_resumed_response(location.store_location.path,
+                                         headers, conn.headers)
+            return b''.join(self._retry_iterator(location, conn,
+                                                 offset=range_start,
+                                                 length=length))
+
+        return utils.iter_ranges(_fetch, start, end, range_size, concurrency,
+                                 self.READ_CHUNKSIZE)
+
     def get_schemes(self):
         return ('http', 'https')
 
@@ -190,9 +416,21 @@ class Store(glance_store.driver.Store):
         :param location: `glance_store.location.Location` object, supplied
                         from glance_store.location.get_location_from_uri()
         """
+        key = location.store_location.get_uri()
+        cached = self._sizes.get(key)
+        headers = None
+        if cached is not None:
+            size, etag, last_modified, checked_at = cached
+            if checked_at + self.url_cache_ttl > time.time():
+                return size
+            if etag:
+                headers = {'If-None-Match': etag}
+            else:
+                headers = {'If-Modified-Since': last_modified}
+
         conn = None
         try:
-            conn, resp, size = self._query(location, 'HEAD')
+            conn, resp, size = self._query(location, 'HEAD', headers=headers)
         except requests.exceptions.ConnectionError as exc:
             err_msg = encodeutils.exception_to_unicode(exc)
             reason = _("The HTTP URL is invalid: %s") % err_msg
@@ -203,20 +441,63 @@ class Store(glance_store.driver.Store):
             # stream=True
             if conn is not None:
                 conn.close()
+
+        if conn.status_code == requests.codes.not_modified:
+            self._sizes.set(key, cached[:3] + (time.time(),))
+            return cached[0]
+
+        etag = conn.headers.get('etag')
+        last_modified = conn.headers.get('last-modified')
+        if etag or last_modified:
+            self._sizes.set(key, (size, etag, last_modified, time.time()))
+        else:
+            self._sizes.pop(key)
         return size
 
-    def _query(self, location, verb):
+    def _query(self, location, verb, headers=None):
+        """Send a request for an image, following its redirects.
+
+        The URL that a location redirects to is remembered for
+        ``http_url_cache_ttl`` seconds and requested directly. The redirects
+        are followed again from the location if that URL fails, or once the
+        TTL has passed.
+        """
+        key = location.store_location.get_uri()
+        resolved = self._redirects.get(key)
+        if resolved is not None:
+            try:
+                return self._follow_redirects(resolved, verb, headers)
+            except (exceptions.NotFound, exceptions.BadStoreUri,
+                    exceptions.MaxRedirectsExceeded,
+                    requests.exceptions.ConnectionError) as e:
+                LOG.debug("Request to the resolved URL of %(path)s failed, "
+                          "following its redirects again: %(error)s",
+                          {'path': location.store_location.path,
+                           'error': encodeutils.exception_to_unicode(e)})
+                self._redirects.pop(key)
+        return self._follow_redirects(location, verb, headers, key=key)
+
+    def _follow_redirects(self, location, verb, headers=None, key=None):
+        """Send a request for an image, following its redirects.
+
+        :param key: if given, the key under which the URL the location
+                    redirects to is remembered
+        """
         redirects_followed = 0
 
         while redirects_followed < MAX_REDIRECTS:
             loc = location.store_location
 
-            conn = self._get_response(loc, verb)
+            conn = self._get_response(loc, verb, headers=headers)
 
             # NOTE(sigmavirus24): If it was generally successful, break early
             if conn.status_code < 300:
                 break
 
+            # NOTE: A conditional request found the image unchanged
+            if conn.status_code == requests.codes.not_modified:
+                break
+
             self._check_store_uri(conn, loc)
 
             redirects_followed += 1
@@ -231,6 +512,9 @@ class Store(glance_store.driver.Store):
             LOG.debug(reason)
             raise exceptions.MaxRedirectsExceeded(message=reason)
 
+        if key is not None and loc.get_uri() != key:
+            self._redirects.set(key, location)
+
         resp = conn.raw
 
         content_length = int(resp.getheader('content-length', 0))
@@ -273,12 +557,32 @@ class Store(glance_store.driver.Store):
             LOG.info(reason)
             raise exceptions.BadStoreUri(message=reason)
 
-    def _get_response(self, location, verb):
-        if not hasattr(self, 'session'):
-            self.session = requests.Session()
-        ca_bundle = self.conf.glance_store.https_ca_certificates_file
-        disable_https = self.conf.glance_store.https_insecure
-        self.session.verify = ca_bundle if ca_bundle else not disable_https
-        self.session.proxies = self.conf.glance_store.http_proxy_information
-        return self.session.request(verb, location.get_uri(), stream=True,
-                                    allow_redirects=False)
+    def _new_session(self, verify, proxies):
+        glance_conf = self.conf.glance_store
+        session = requests.Session()
+        session.verify = verify
+        session.proxies = dict(proxies)
+        if not glance_conf.http_keep_alive:
+            session.headers['Connection'] = 'close'
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=glance_conf.http_pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _get_session(self, location):
+        glance_conf = self.conf.glance_store
+        ca_bundle = glance_conf.https_ca_certificates_file
+        verify = ca_bundle if ca_bundle else not glance_conf.https_insecure
+        proxies = glance_conf.http_proxy_information
+        proxy = proxies.get(location.scheme)
+        key = (location.scheme, location.netloc, verify, proxy)
+        return self.sessions.get(
+            key, lambda: self._new_session(verify, proxies))
+
+    def _get_response(self, location, verb, headers=None):
+        session = self._get_session(location)
+        kwargs = {'stream': True, 'allow_redirects': False}
+        if headers:
+            kwargs['headers'] = headers
+        return session.request(verb, location.get_uri(), **kwargs)
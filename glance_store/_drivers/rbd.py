@@ -18,11 +18,18 @@
 from __future__ import absolute_import
 from __future__ import with_statement
 
+import bisect
+import collections
 import contextlib
 import hashlib
 import logging
 import math
+import os
+import threading
+import time
 
+import eventlet
+from eventlet import tpool
 from oslo_config import cfg
 from oslo_utils import units
 import six
@@ -48,10 +55,18 @@ DEFAULT_CONFFILE = '/etc/ceph/ceph.conf'
 DEFAULT_USER = None    # let librados decide based on the Ceph conf file
 DEFAULT_CHUNKSIZE = 8  # in MiB
 DEFAULT_SNAPNAME = 'snap'
+DEFAULT_CONNECTION_POOL_SIZE = 4
+DEFAULT_CONNECTION_IDLE_TIMEOUT = 300
+DEFAULT_READ_WINDOW = 4
+DEFAULT_WRITE_WINDOW = 4
+DEFAULT_RESIZE_GROWTH_FACTOR = 2.0
+DEFAULT_RESIZE_MAX_STEP = 1024  # in MiB
+DEFAULT_TRASH_PURGE_INTERVAL = 1.0
 
 LOG = logging.getLogger(__name__)
 _LI = i18n._LI
 _LE = i18n._LE
+_LW = i18n._LW
 
 _RBD_OPTS = [
     cfg.IntOpt('rbd_store_chunk_size', default=DEFAULT_CHUNKSIZE,
@@ -60,6 +75,54 @@ _RBD_OPTS = [
                       'a power of two.')),
     cfg.StrOpt('rbd_store_pool', default=DEFAULT_POOL,
                help=_('RADOS pool in which images are stored.')),
+    cfg.IntOpt('rbd_store_read_window', default=DEFAULT_READ_WINDOW,
+               help=_('The number of chunks of an image being downloaded '
+                      'that are read from RADOS ahead of time. Up to this '
+                      'many chunks are held in memory per download. If '
+                      'value <= 1, or if librbd does not support '
+                      'asynchronous reads, chunks are read one at a time.')),
+    cfg.BoolOpt('rbd_store_sparse_read', default=True,
+                help=_('Whether the allocated extents of an image are looked '
+                       'up before downloading it, so that only these are '
+                       'read from RADOS and the zeros of the unallocated '
+                       'extents are made locally instead.')),
+    cfg.IntOpt('rbd_store_write_window', default=DEFAULT_WRITE_WINDOW,
+               help=_('The number of chunks of an image being uploaded that '
+                      'are written to RADOS concurrently. Up to this many '
+                      'chunks are held in memory per upload. If value <= 1, '
+                      'or if librbd does not support asynchronous writes, '
+                      'chunks are written one at a time.')),
+    cfg.FloatOpt('rbd_store_resize_growth_factor',
+                 default=DEFAULT_RESIZE_GROWTH_FACTOR,
+                 help=_('When the size of an image being uploaded is not '
+                        'known, the image is grown by this factor each time '
+                        'the data written reaches its end, and shrunk to the '
+                        'size of the data at the end of the upload. If value '
+                        '<= 1, the image is grown before writing each chunk '
+                        'to just fit it.')),
+    cfg.IntOpt('rbd_store_resize_max_step', default=DEFAULT_RESIZE_MAX_STEP,
+               help=_('The largest amount, in megabytes, by which an image '
+                      'of unknown size is grown at once while it is '
+                      'uploaded.')),
+    cfg.BoolOpt('rbd_store_deferred_delete', default=False,
+                help=_('Whether deleted images are moved to the RBD trash '
+                       'and removed from it in the background, instead of '
+                       'being removed before the delete returns. Requires '
+                       'Ceph Luminous or later, images are removed before '
+                       'the delete returns otherwise. Images still in the '
+                       'trash when the process exits are left there, and '
+                       'can be removed with "rbd trash purge".')),
+    cfg.FloatOpt('rbd_store_trash_purge_interval',
+                 default=DEFAULT_TRASH_PURGE_INTERVAL,
+                 help=_('The time, in seconds, to wait after removing an '
+                        'image from the RBD trash before removing the next '
+                        'one, to limit the load purging the trash puts on '
+                        'the cluster.')),
+    cfg.BoolOpt('rbd_thin_provisioning', default=True,
+                help=_('Whether chunks of an image being uploaded that only '
+                       'contain zeros are skipped instead of written. New '
+                       'images read as zeros where nothing was written, so '
+                       'skipping them keeps the images thin provisioned.')),
     cfg.StrOpt('rbd_store_user', default=DEFAULT_USER,
                help=_('RADOS user to authenticate as (only applicable if '
                       'using Cephx. If <None>, a default will be chosen based '
@@ -73,7 +136,17 @@ _RBD_OPTS = [
     cfg.IntOpt('rados_connect_timeout', default=0,
                help=_('Timeout value (in seconds) used when connecting to '
                       'ceph cluster. If value <= 0, no timeout is set and '
-                      'default librados value is used.'))
+                      'default librados value is used.')),
+    cfg.IntOpt('rados_connection_pool_size',
+               default=DEFAULT_CONNECTION_POOL_SIZE,
+               help=_('The maximum number of idle connections to the ceph '
+                      'cluster kept open for reuse, per configuration file '
+                      'and user. If value <= 0, every operation connects to '
+                      'the cluster and disconnects when done.')),
+    cfg.IntOpt('rados_connection_idle_timeout',
+               default=DEFAULT_CONNECTION_IDLE_TIMEOUT,
+               help=_('The number of seconds after which an idle connection '
+                      'to the ceph cluster is closed.'))
 ]
 
 
@@ -147,12 +220,196 @@ class StoreLocation(location.StoreLocation):
             raise exceptions.BadStoreUri(message=reason)
 
 
+class _PooledConnection(object):
+    """
+    A connected cluster handle, with the I/O contexts it opened.
+
+    The I/O contexts stay open as long as the handle, which is only ever
+    used by one operation at a time.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.pid = os.getpid()
+        self.last_used = time.time()
+        self._ioctxs = {}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    @contextlib.contextmanager
+    def open_ioctx(self, pool):
+        ioctx = self._ioctxs.get(pool)
+        if ioctx is None:
+            ioctx = self.client.open_ioctx(pool)
+            self._ioctxs[pool] = ioctx
+        yield ioctx
+
+    def is_healthy(self):
+        return getattr(self.client, 'state', 'connected') == 'connected'
+
+    def shutdown(self):
+        for ioctx in self._ioctxs.values():
+            ioctx.close()
+        self._ioctxs.clear()
+        self.client.shutdown()
+
+
+class ConnectionPool(object):
+    """
+    A process-wide pool of idle connections to ceph clusters.
+
+    Connections are keyed by configuration file and user. Those made before
+    a fork are dropped in the child process, which cannot use them.
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def get(self, key, idle_timeout):
+        """Return a healthy idle connection for `key`, or None."""
+        now = time.time()
+        stale = []
+        conn = None
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate = idle.pop()
+                idle_time = now - candidate.last_used
+                if idle_time < idle_timeout and candidate.is_healthy():
+                    conn = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.shutdown()
+        return conn
+
+    def put(self, key, conn, max_size, idle_timeout):
+        """Keep `conn` for reuse, closing the connections in excess."""
+        if conn.pid != os.getpid():
+            return
+        now = time.time()
+        conn.last_used = now
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.setdefault(key, [])
+            idle.append(conn)
+            keep = [c for c in idle if now - c.last_used < idle_timeout]
+            keep = keep[-max_size:]
+            stale = [c for c in idle if c not in keep]
+            idle[:] = keep
+        for candidate in stale:
+            candidate.shutdown()
+
+    def clear(self):
+        with self._lock:
+            idle = [c for conns in self._idle.values() for c in conns]
+            self._idle = {}
+            forked = self._pid != os.getpid()
+            self._pid = os.getpid()
+        if not forked:
+            for conn in idle:
+                conn.shutdown()
+
+
+CONNECTION_POOL = ConnectionPool()
+
+
+class ImageWriter(object):
+    """
+    Writes data to an RBD image, keeping several writes in flight.
+
+    Up to `window` chunks are written with ``aio_write`` at once, so that
+    they can go to different objects of the image concurrently. Failed
+    writes are reported by the next call to `write` or `flush`.
+
+    With `skip_zeros`, chunks only made of zeros are not written at all, as
+    the image is expected to be new and so to read as zeros already.
+    """
+
+    def __init__(self, image, window, skip_zeros=False):
+        self.image = image
+        self.window = window
+        self.skip_zeros = skip_zeros
+        self.use_aio = window > 1 and hasattr(image, 'aio_write')
+        self._pending = collections.deque()
+        self._error = None
+        self._zeros = b''
+
+    def _is_zero(self, data):
+        if len(data) != len(self._zeros):
+            self._zeros = b'\0' * len(data)
+        return data == self._zeros
+
+    def _on_complete(self, completion):
+        # NOTE: This runs in a librbd thread, so it only records the error
+        ret = completion.get_return_value()
+        if ret < 0 and self._error is None:
+            self._error = ret
+
+    def _check_error(self):
+        if self._error is not None:
+            reason = (_("Failed to write to RBD image: %s") %
+                      os.strerror(-self._error))
+            LOG.error(reason)
+            raise exceptions.BackendException(reason)
+
+    def _wait_oldest(self):
+        # The chunk is kept referenced until its write completed
+        completion, data = self._pending.popleft()
+        completion.wait_for_complete_and_cb()
+
+    def write(self, data, offset):
+        """Write `data` at `offset`, returning the number of bytes written.
+        """
+        if self.skip_zeros and self._is_zero(data):
+            return len(data)
+        if not self.use_aio:
+            return self.image.write(data, offset)
+
+        self._check_error()
+        if len(self._pending) >= self.window:
+            self._wait_oldest()
+            self._check_error()
+        completion = self.image.aio_write(data, offset, self._on_complete)
+        self._pending.append((completion, data))
+        return len(data)
+
+    def flush(self):
+        """Wait for all the writes, raising if any of them failed."""
+        self.close()
+        self._check_error()
+
+    def close(self):
+        """Wait for all the writes, ignoring their errors."""
+        while self._pending:
+            self._wait_oldest()
+
+
 class ImageIterator(object):
     """
     Reads data from an RBD image, one chunk at a time.
+
+    Up to `window` chunks are read ahead with ``aio_read``, and yielded in
+    order as they complete.
+
+    With `sparse`, the allocated extents of the image are looked up first
+    with ``diff_iterate``, and chunks falling in unallocated extents are
+    made of zeros without reading them. This is only done for images with
+    the fast-diff feature, whose object map tells the extents without
+    querying every object of the image.
     """
 
-    def __init__(self, pool, name, snapshot, store, chunk_size=None):
+    def __init__(self, pool, name, snapshot, store, chunk_size=None,
+                 offset=0, length=None, window=1, sparse=False):
         self.pool = pool or store.pool
         self.name = name
         self.snapshot = snapshot
@@ -160,6 +417,12 @@ class ImageIterator(object):
         self.conf_file = store.conf_file
         self.chunk_size = chunk_size or store.READ_CHUNKSIZE
         self.store = store
+        self.offset = offset
+        self.length = length
+        self.window = window
+        self.sparse = sparse
+        self._extents = None
+        self._zero_chunk = b''
 
     def __iter__(self):
         try:
@@ -169,32 +432,138 @@ class ImageIterator(object):
                     with rbd.Image(ioctx, self.name,
                                    snapshot=self.snapshot) as image:
                         img_info = image.stat()
-                        size = img_info['size']
-                        bytes_left = size
-                        while bytes_left > 0:
-                            length = min(self.chunk_size, bytes_left)
-                            data = image.read(size - bytes_left, length)
-                            bytes_left -= len(data)
+                        end = img_info['size']
+                        if self.length is not None:
+                            end = min(end, self.offset + self.length)
+                        sparse = self.sparse and self.offset < end
+                        if sparse and self._has_fast_diff(image):
+                            self._extents = self._map_extents(
+                                image, self.offset, end)
+                        if self.window > 1 and hasattr(image, 'aio_read'):
+                            reader = self._read_ahead
+                        else:
+                            reader = self._read
+                        for data in reader(image, self.offset, end):
                             yield data
-                        raise StopIteration()
         except rbd.ImageNotFound:
             raise exceptions.NotFound(
                 _('RBD image %s does not exist') % self.name)
 
+    def _has_fast_diff(self, image):
+        fast_diff = getattr(rbd, 'RBD_FEATURE_FAST_DIFF', None)
+        if fast_diff is None or not hasattr(image, 'diff_iterate'):
+            return False
+        return bool(image.features() & fast_diff)
+
+    def _map_extents(self, image, offset, end):
+        """Return the starts and ends of the allocated extents in range.
+
+        Extents are reported per object of the image, as ``whole_object``
+        lets librbd use the object map rather than read every object.
+        """
+        extents = []
+
+        def _add_extent(ext_offset, ext_length, exists):
+            if exists:
+                extents.append((ext_offset, ext_offset + ext_length))
+
+        # NOTE: diff_iterate blocks until the whole range was looked up, so
+        # it runs in a native thread to not stall the other greenthreads.
+        tpool.execute(image.diff_iterate, offset, end - offset, None,
+                      _add_extent, whole_object=True)
+        extents.sort()
+        return [e[0] for e in extents], [e[1] for e in extents]
+
+    def _is_hole(self, offset, length):
+        if self._extents is None:
+            return False
+        starts, ends = self._extents
+        i = bisect.bisect_left(starts, offset + length) - 1
+        return i < 0 or ends[i] <= offset
+
+    def _zeros(self, length):
+        if len(self._zero_chunk) != length:
+            self._zero_chunk = b'\0' * length
+        return self._zero_chunk
+
+    def _read(self, image, offset, end):
+        while offset < end:
+            length = min(self.chunk_size, end - offset)
+            if self._is_hole(offset, length):
+                data = self._zeros(length)
+            else:
+                data = image.read(offset, length)
+            if not data:
+                return
+            offset += len(data)
+            yield data
+
+    def _read_ahead(self, image, offset, end):
+        pending = collections.deque()
+        try:
+            while offset < end or pending:
+                while offset < end and len(pending) < self.window:
+                    length = min(self.chunk_size, end - offset)
+                    pending.append(self._submit_read(image, offset, length))
+                    offset += length
+                completion, result, length = pending.popleft()
+                if completion is not None:
+                    completion.wait_for_complete_and_cb()
+                    ret = completion.get_return_value()
+                else:
+                    ret = 0
+                if ret < 0:
+                    reason = (_("Failed to read from RBD image %(name)s: "
+                                "%(error)s") %
+                              {'name': self.name,
+                               'error': os.strerror(-ret)})
+                    LOG.error(reason)
+                    raise exceptions.BackendException(reason)
+                data = result[0]
+                if data:
+                    yield data
+                if len(data) < length:
+                    # The image ended early, skip the reads past its end
+                    return
+        finally:
+            # The reads must complete before the image can be closed
+            for completion, result, length in pending:
+                if completion is not None:
+                    completion.wait_for_complete_and_cb()
+
+    def _submit_read(self, image, offset, length):
+        if self._is_hole(offset, length):
+            return None, [self._zeros(length)], length
+
+        result = []
+
+        def _on_complete(completion, data):
+            # NOTE: This runs in a librbd thread, so it only keeps the data
+            result.append(data or b'')
+
+        completion = image.aio_read(offset, length, _on_complete)
+        return completion, result, length
+
 
 class Store(driver.Store):
     """An implementation of the RBD backend adapter."""
 
-    _CAPABILITIES = capabilities.BitMasks.RW_ACCESS
+    _CAPABILITIES = (capabilities.BitMasks.READ_RANDOM |
+                     capabilities.BitMasks.WRITE_ACCESS)
     OPTIONS = _RBD_OPTS
 
     EXAMPLE_URL = "rbd://<FSID>/<POOL>/<IMAGE>/<SNAP>"
 
+    def __init__(self, conf):
+        super(Store, self).__init__(conf)
+        self._trash = collections.deque()
+        self._purging = False
+        self._trash_lock = threading.Lock()
+
     def get_schemes(self):
         return ('rbd',)
 
-    @contextlib.contextmanager
-    def get_connection(self, conffile, rados_id):
+    def _connect(self, conffile, rados_id):
         client = rados.Rados(conffile=conffile, rados_id=rados_id)
 
         try:
@@ -203,10 +572,46 @@ class Store(driver.Store):
             msg = _LE("Error connecting to ceph cluster.")
             LOG.exception(msg)
             raise exceptions.BackendException()
+        return client
+
+    @contextlib.contextmanager
+    def get_connection(self, conffile, rados_id):
+        """
+        Connect to the cluster, reusing an idle connection if there is one.
+
+        Connections are given back to `CONNECTION_POOL` when done, unless an
+        error was raised while they were used: except for the errors about
+        an image which leave the connection usable, the connection may be
+        broken, so it is shut down rather than reused.
+        """
+        if self.connection_pool_size <= 0:
+            client = self._connect(conffile, rados_id)
+            try:
+                yield client
+            finally:
+                client.shutdown()
+            return
+
+        key = (conffile, rados_id)
+        conn = CONNECTION_POOL.get(key, self.connection_idle_timeout)
+        if conn is None:
+            conn = _PooledConnection(self._connect(conffile, rados_id))
+        reusable = True
         try:
-            yield client
+            yield conn
+        except (rbd.ImageNotFound, rbd.ImageExists, rbd.ImageBusy,
+                exceptions.NotFound, exceptions.Duplicate,
+                exceptions.InUseByStore, exceptions.HasSnapshot):
+            raise
+        except Exception:
+            reusable = False
+            raise
         finally:
-            client.shutdown()
+            if reusable:
+                CONNECTION_POOL.put(key, conn, self.connection_pool_size,
+                                    self.connection_idle_timeout)
+            else:
+                conn.shutdown()
 
     def configure_add(self):
         """
@@ -227,6 +632,23 @@ class Store(driver.Store):
             self.user = str(self.conf.glance_store.rbd_store_user)
             self.conf_file = str(self.conf.glance_store.rbd_store_ceph_conf)
             self.connect_timeout = self.conf.glance_store.rados_connect_timeout
+            self.read_window = self.conf.glance_store.rbd_store_read_window
+            self.sparse_read = self.conf.glance_store.rbd_store_sparse_read
+            self.write_window = self.conf.glance_store.rbd_store_write_window
+            self.thin_provisioning = (
+                self.conf.glance_store.rbd_thin_provisioning)
+            self.deferred_delete = (
+                self.conf.glance_store.rbd_store_deferred_delete)
+            self.trash_purge_interval = (
+                self.conf.glance_store.rbd_store_trash_purge_interval)
+            self.resize_growth_factor = (
+                self.conf.glance_store.rbd_store_resize_growth_factor)
+            self.resize_max_step = (
+                self.conf.glance_store.rbd_store_resize_max_step * units.Mi)
+            self.connection_pool_size = (
+                self.conf.glance_store.rados_connection_pool_size)
+            self.connection_idle_timeout = (
+                self.conf.glance_store.rados_connection_idle_timeout)
         except cfg.ConfigFileValueError as e:
             reason = _("Error in store configuration: %s") % e
             LOG.error(reason)
@@ -245,8 +667,15 @@ class Store(driver.Store):
         :raises: `glance_store.exceptions.NotFound` if image does not exist
         """
         loc = location.store_location
-        return (ImageIterator(loc.pool, loc.image, loc.snapshot, self),
-                self.get_size(location))
+        image_size = self.get_size(location)
+        length = max(image_size - offset, 0)
+        if chunk_size is not None:
+            length = min(length, chunk_size)
+        return (ImageIterator(loc.pool, loc.image, loc.snapshot, self,
+                              offset=offset, length=length,
+                              window=self.read_window,
+                              sparse=self.sparse_read),
+                length)
 
     def get_size(self, location, context=None):
         """
@@ -334,7 +763,11 @@ class Store(driver.Store):
                                 raise exceptions.InUseByStore()
 
                     # Then delete image.
-                    rbd.RBD().remove(ioctx, image_name)
+                    use_trash = hasattr(rbd.RBD, 'trash_move')
+                    if self.deferred_delete and use_trash:
+                        self._move_to_trash(ioctx, target_pool, image_name)
+                    else:
+                        rbd.RBD().remove(ioctx, image_name)
                 except rbd.ImageHasSnapshots:
                     log_msg = (_LE("Remove image %(img_name)s failed. "
                                    "It has snapshot(s) left.") %
@@ -381,9 +814,9 @@ class Store(driver.Store):
                 LOG.debug('creating image %s with order %d and size %d',
                           image_name, order, image_size)
                 if image_size == 0:
-                    LOG.warning(_("since image size is zero we will be doing "
-                                  "resize-before-write for each chunk which "
-                                  "will be considerably slower than normal"))
+                    LOG.warning(_("since image size is zero we will be "
+                                  "resizing the image while writing it, which "
+                                  "will be slower than normal"))
 
                 try:
                     loc = self._create_image(fsid, conn, ioctx, image_name,
@@ -396,26 +829,41 @@ class Store(driver.Store):
                     with rbd.Image(ioctx, image_name) as image:
                         bytes_written = 0
                         offset = 0
+                        current_size = image_size
                         chunks = utils.chunkreadable(image_file,
                                                      self.WRITE_CHUNKSIZE)
-                        for chunk in chunks:
-                            # If the image size provided is zero we need to do
-                            # a resize for the amount we are writing. This will
-                            # be slower so setting a higher chunk size may
-                            # speed things up a bit.
-                            if image_size == 0:
-                                chunk_length = len(chunk)
-                                length = offset + chunk_length
-                                bytes_written += chunk_length
-                                LOG.debug(_("resizing image to %s KiB") %
-                                          (length / units.Ki))
-                                image.resize(length)
-                            LOG.debug(_("writing chunk at offset %s") %
-                                      (offset))
-                            offset += image.write(chunk, offset)
-                            checksum.update(chunk)
-                            if verifier:
-                                verifier.update(chunk)
+                        writer = ImageWriter(image, self.write_window,
+                                             self.thin_provisioning)
+                        try:
+                            for chunk in chunks:
+                                # If the image size provided is zero we need
+                                # to grow the image to fit what we are
+                                # writing. It is grown by more than needed,
+                                # so that it is not resized for every chunk.
+                                if image_size == 0:
+                                    chunk_length = len(chunk)
+                                    length = offset + chunk_length
+                                    bytes_written += chunk_length
+                                    if length > current_size:
+                                        current_size = self._grow_size(
+                                            current_size, length)
+                                        LOG.debug(_("resizing image to %s "
+                                                    "KiB") %
+                                                  (current_size / units.Ki))
+                                        image.resize(current_size)
+                                LOG.debug(_("writing chunk at offset %s") %
+                                          (offset))
+                                offset += writer.write(chunk, offset)
+                                checksum.update(chunk)
+                                if verifier:
+                                    verifier.update(chunk)
+                            writer.flush()
+                        finally:
+                            writer.close()
+                        if current_size > bytes_written and image_size == 0:
+                            LOG.debug(_("resizing image to %s KiB") %
+                                      (bytes_written / units.Ki))
+                            image.resize(bytes_written)
                         if loc.snapshot:
                             image.create_snap(loc.snapshot)
                             image.protect_snap(loc.snapshot)
@@ -442,6 +890,70 @@ class Store(driver.Store):
 
         return (loc.get_uri(), image_size, checksum.hexdigest(), {})
 
+    def _move_to_trash(self, ioctx, target_pool, image_name):
+        """
+        Move an RBD image to the trash, and schedule its removal from it.
+
+        :raises: HasSnapshot if the image has snapshots
+        """
+        with rbd.Image(ioctx, image_name) as image:
+            # The trash accepts images with snapshots, but could not
+            # remove them from it later.
+            if list(image.list_snaps()):
+                log_msg = (_LE("Remove image %(img_name)s failed. "
+                               "It has snapshot(s) left.") %
+                           {'img_name': image_name})
+                LOG.error(log_msg)
+                raise exceptions.HasSnapshot()
+            image_id = image.id()
+        rbd.RBD().trash_move(ioctx, image_name, 0)
+        LOG.debug("Moved RBD image %(name)s to the trash of pool %(pool)s "
+                  "as %(id)s", {'name': image_name, 'pool': target_pool,
+                                'id': image_id})
+
+        with self._trash_lock:
+            self._trash.append((target_pool, image_id))
+            if self._purging:
+                return
+            self._purging = True
+        eventlet.spawn_n(self._purge_trash)
+
+    def _purge_trash(self):
+        """Remove the images moved to the trash, one at a time."""
+        while True:
+            with self._trash_lock:
+                if not self._trash:
+                    self._purging = False
+                    return
+                target_pool, image_id = self._trash.popleft()
+
+            try:
+                with self.get_connection(conffile=self.conf_file,
+                                         rados_id=self.user) as conn:
+                    with conn.open_ioctx(target_pool) as ioctx:
+                        # Removing the image blocks until all its objects
+                        # are deleted, so it must not block the hub.
+                        tpool.execute(rbd.RBD().trash_remove, ioctx,
+                                      image_id)
+            except Exception as exc:
+                LOG.warning(_LW("Failed to remove RBD image %(id)s from the "
+                                "trash of pool %(pool)s: %(exc)s. It can be "
+                                "removed with \"rbd trash rm\"."),
+                            {'id': image_id, 'pool': target_pool,
+                             'exc': exc})
+            eventlet.sleep(self.trash_purge_interval)
+
+    def _grow_size(self, current_size, needed_size):
+        """
+        Returns the size to grow an image of unknown size to, so that at
+        least `needed_size` bytes fit in it.
+        """
+        if self.resize_growth_factor <= 1:
+            return needed_size
+        step = int(current_size * (self.resize_growth_factor - 1))
+        step = min(step, self.resize_max_step)
+        return max(needed_size, current_size + step)
+
     @capabilities.check
     def delete(self, location, context=None):
         """
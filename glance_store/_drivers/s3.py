@@ -47,6 +47,7 @@ DEFAULT_LARGE_OBJECT_SIZE = 100          # 100M
 DEFAULT_LARGE_OBJECT_CHUNK_SIZE = 10     # 10M
 DEFAULT_LARGE_OBJECT_MIN_CHUNK_SIZE = 5  # 5M
 DEFAULT_THREAD_POOLS = 10                # 10 pools
+DEFAULT_HEAD_CACHE_TTL = 5               # 5 seconds
 MAX_PART_NUM = 10000                     # 10000 upload parts
 
 _S3_OPTS = [
@@ -89,7 +90,13 @@ _S3_OPTS = [
     cfg.StrOpt('s3_store_proxy_user',
                help=_('The username to connect to the proxy.')),
     cfg.StrOpt('s3_store_proxy_password', secret=True,
-               help=_('The password to use when connecting over a proxy.'))
+               help=_('The password to use when connecting over a proxy.')),
+    cfg.IntOpt('s3_store_head_cache_ttl', default=DEFAULT_HEAD_CACHE_TTL,
+               help=_('The number of seconds the size of an S3 object, as '
+                      'returned by a HEAD request, is cached for get_size '
+                      'calls. The cache is invalidated when the image is '
+                      'added or deleted through this store. Set it to 0 to '
+                      'disable the cache.'))
 ]
 
 
@@ -323,6 +330,13 @@ class Store(glance_store.driver.Store):
     def get_schemes(self):
         return ('s3', 's3+http', 's3+https')
 
+    def configure(self, re_raise_bsc=False):
+        ttl = self.conf.glance_store.s3_store_head_cache_ttl
+        self._head_cache = utils.ExpiringCache(ttl)
+        # NOTE: ``Store`` is wrapped by the debtcollector deprecation
+        # decorator, so it cannot be handed to super() here.
+        glance_store.driver.Store.configure(self, re_raise_bsc=re_raise_bsc)
+
     def configure_add(self):
         """
         Configure the Store to use the stored configuration options
@@ -426,7 +440,7 @@ class Store(glance_store.driver.Store):
                         from glance_store.location.get_location_from_uri()
         :raises: `glance_store.exceptions.NotFound` if image does not exist
         """
-        key = self._retrieve_key(location)
+        key = self._open_key(location)
         cs = self.READ_CHUNKSIZE
         key.BufferSize = cs
 
@@ -446,27 +460,61 @@ class Store(glance_store.driver.Store):
         :param location: `glance_store.location.Location` object, supplied
                         from glance_store.location.get_location_from_uri()
         """
+        loc = location.store_location
+        cache_key = self._head_cache_key(loc)
+        size = self._head_cache.get(cache_key)
+        if size is not None:
+            return size
+
         try:
-            key = self._retrieve_key(location)
+            s3_conn = self._create_connection(loc)
+            # NOTE: Skip validating the bucket, the HEAD on the key below
+            # fails the same way if the bucket is missing.
+            bucket_obj = s3_conn.get_bucket(loc.bucket, validate=False)
+            key = bucket_obj.get_key(loc.key)
+            if not key:
+                return 0
+            self._head_cache.set(cache_key, key.size)
             return key.size
         except Exception:
             return 0
 
-    def _retrieve_key(self, location):
-        loc = location.store_location
-        s3_conn = self._create_connection(loc)
-        bucket_obj = get_bucket(s3_conn, loc.bucket)
+    def _head_cache_key(self, loc):
+        return (loc.s3serviceurl, loc.bucket, loc.key)
 
-        key = get_key(bucket_obj, loc.key)
+    def _open_key(self, location):
+        """
+        Issue the GET for the object straight away, without looking up the
+        bucket or the key first. The size and ETag of the object are read
+        from the headers of the GET response.
 
-        msg = ("Retrieved image object from S3 using (s3_host=%(s3_host)s, "
-               "access_key=%(accesskey)s, bucket=%(bucket)s, "
-               "key=%(obj_name)s)" % ({'s3_host': loc.s3serviceurl,
-                                       'accesskey': loc.accesskey,
-                                       'bucket': loc.bucket,
-                                       'obj_name': loc.key}))
-        LOG.debug(msg)
+        :raises: `glance_store.exceptions.NotFound` if image does not exist
+        """
+        from boto.exception import S3ResponseError
 
+        loc = location.store_location
+        s3_conn = self._create_connection(loc)
+        bucket_obj = s3_conn.get_bucket(loc.bucket, validate=False)
+        key = bucket_obj.get_key(loc.key, validate=False)
+        try:
+            key.open_read()
+        except S3ResponseError as e:
+            if e.status == http_client.NOT_FOUND:
+                msg = (_("Could not find key %(obj)s in bucket %(bucket)s") %
+                       {'obj': loc.key, 'bucket': loc.bucket})
+                LOG.debug(msg)
+                raise exceptions.NotFound(message=msg)
+            raise
+
+        LOG.debug("Opened image object from S3 using (s3_host=%(s3_host)s, "
+                  "access_key=%(accesskey)s, bucket=%(bucket)s, "
+                  "key=%(obj_name)s, etag=%(etag)s)" %
+                  {'s3_host': loc.s3serviceurl,
+                   'accesskey': loc.accesskey,
+                   'bucket': loc.bucket,
+                   'obj_name': loc.key,
+                   'etag': key.etag})
+        self._head_cache.set(self._head_cache_key(loc), key.size)
         return key
 
     @capabilities.check
@@ -525,6 +573,8 @@ class Store(glance_store.driver.Store):
         LOG.debug("Uploading an image file to S3 for %s" %
                   self._sanitize(loc.get_uri()))
 
+        self._head_cache.pop(self._head_cache_key(loc))
+
         if image_size < self.s3_store_large_object_size:
             return self.add_singlepart(image_file, bucket_obj, obj_name, loc,
                                        verifier)
@@ -723,6 +773,7 @@ class Store(glance_store.driver.Store):
                                          'obj_name': loc.key})
         LOG.debug(msg)
 
+        self._head_cache.pop(self._head_cache_key(loc))
         return key.delete()
 
 
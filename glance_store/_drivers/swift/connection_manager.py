@@ -82,15 +82,12 @@ class SwiftConnectionManager(object):
             # connection manager users. Also we disable re-authentication
             # if there is not way to execute it (cannot initialize trusts for
             # multi-tenant or auth_version is not 3)
-            auth_ref = self.client.session.auth.get_auth_ref(
-                self.client.session)
             # if connection token is going to expire soon (keystone checks
             # is token is going to expire or expired already)
-            if auth_ref.will_expire_soon(
-                self.store.conf.glance_store.swift_store_expire_soon_interval
-            ):
+            if self._token_will_expire_soon():
                 LOG.info(_LI("Requesting new token for swift connection."))
                 # request new token with session and client provided by store
+                self.client.session.auth.invalidate()
                 auth_token = self.client.session.get_auth_headers().get(
                     self.AUTH_HEADER_NAME)
                 LOG.info(_LI("Token has been successfully requested. "
@@ -113,8 +110,17 @@ class SwiftConnectionManager(object):
             self._client = self._init_client()
         return self._client
 
+    def _token_will_expire_soon(self):
+        """Check the token held by the client without fetching a new one."""
+        auth_ref = self.client.session.auth.get_access(self.client.session)
+        return auth_ref.will_expire_soon(
+            self.store.conf.glance_store.swift_store_expire_soon_interval)
+
     def _init_connection(self):
         """Initialize and return valid Swift connection."""
+        if self._token_will_expire_soon():
+            # a client shared by the store may hold an old token
+            self.client.session.auth.invalidate()
         auth_token = self.client.session.get_auth_headers().get(
             self.AUTH_HEADER_NAME)
         return self.store.get_store_connection(
@@ -169,6 +175,12 @@ class SingleTenantConnectionManager(SwiftConnectionManager):
             # use good old connection initialization
             return self.store.get_connection(self.location, self.context)
 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.store.auth_version != '3':
+            # remember the token the connection got, so that the next
+            # connection does not need to authenticate again
+            self.store._cache_auth(self.location, self.connection)
+
 
 class MultiTenantConnectionManager(SwiftConnectionManager):
 
@@ -213,3 +225,33 @@ class MultiTenantConnectionManager(SwiftConnectionManager):
 
         return self.store.get_store_connection(
             self.context.auth_token, self.storage_url)
+
+
+class WorkerConnectionManager(object):
+    """Connection manager for a greenthread working for another manager.
+
+    swiftclient connections hold a single HTTP connection, so they must not
+    be shared between greenthreads. A worker manager hands out a connection
+    of its own that reuses the token and storage URL of the parent manager's
+    connection, and follows the parent when it refreshes the token.
+    """
+
+    def __init__(self, parent, store, store_location, context=None):
+        self.parent = parent
+        self.store = store
+        self.location = store_location
+        self.context = context
+        self.connection = None
+
+    def get_connection(self):
+        parent_connection = self.parent.get_connection()
+        if not (parent_connection.url and parent_connection.token):
+            # an unauthenticated connection cannot be cloned
+            if self.connection is None:
+                self.connection = self.store.get_connection(
+                    self.location, context=self.context)
+        elif getattr(self.connection, 'token', None) != (
+                parent_connection.token):
+            self.connection = self.store.get_store_connection(
+                parent_connection.token, parent_connection.url)
+        return self.connection
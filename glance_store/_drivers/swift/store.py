@@ -16,15 +16,21 @@
 """Storage backend for SWIFT"""
 
 import hashlib
+import itertools
 import logging
 import math
+import time
 
+import eventlet
 from keystoneclient import exceptions as keystone_exc
 from keystoneclient import service_catalog as keystone_sc
 from oslo_config import cfg
+from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
 from oslo_utils import excutils
 from oslo_utils import units
+import requests
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
 import six
 from six.moves import http_client
 from six.moves import urllib
@@ -41,6 +47,7 @@ import glance_store
 from glance_store._drivers.swift import connection_manager
 from glance_store._drivers.swift import utils as sutils
 from glance_store import capabilities
+from glance_store.common import utils as gutils
 from glance_store import driver
 from glance_store import exceptions
 from glance_store import i18n
@@ -55,6 +62,19 @@ DEFAULT_CONTAINER = 'glance'
 DEFAULT_LARGE_OBJECT_SIZE = 5 * units.Ki  # 5GB
 DEFAULT_LARGE_OBJECT_CHUNK_SIZE = 200  # 200M
 ONE_MB = units.k * units.Ki  # Here we used the mixed meaning of MB
+DEFAULT_DELETE_CONCURRENCY = 10
+DEFAULT_DOWNLOAD_RANGE_SIZE = 16  # 16M
+DEFAULT_MAX_BULK_DELETES = 10000
+SWIFT_INFO_CACHE_TTL = 3600  # 1 hour
+DEFAULT_AUTH_CACHE_TTL = 600  # 10 minutes
+DEFAULT_CONTAINER_CACHE_TTL = 300  # 5 minutes
+CONTAINER_CACHE_SIZE = 1024
+UPLOAD_SESSION_PREFIX = 'upload-sessions/'
+DEFAULT_RETRY_GET_BACKOFF = 0.5
+
+# NOTE: Capabilities advertised by the Swift clusters in /info, keyed by
+# storage URL. They only change when the cluster is reconfigured.
+_SWIFT_INFO_CACHE = gutils.ExpiringCache(SWIFT_INFO_CACHE_TTL)
 
 _SWIFT_OPTS = [
     cfg.BoolOpt('swift_store_auth_insecure', default=False,
@@ -126,6 +146,17 @@ _SWIFT_OPTS = [
     cfg.IntOpt('swift_store_retry_get_count', default=0,
                help=_('The number of times a Swift download will be retried '
                       'before the request fails.')),
+    cfg.FloatOpt('swift_store_retry_get_backoff',
+                 default=DEFAULT_RETRY_GET_BACKOFF,
+                 help=_('The base delay, in seconds, before retrying a Swift '
+                        'download. The delay doubles with every retry, up '
+                        'to 30 seconds, and a random part of it is used so '
+                        'that downloads failing together do not retry '
+                        'together.')),
+    cfg.IntOpt('swift_store_retry_get_deadline', default=0,
+               help=_('The number of seconds after which a Swift download '
+                      'is not retried anymore, counted from the start of '
+                      'the download. The default of 0 means no deadline.')),
     cfg.IntOpt('swift_store_expire_soon_interval', default=60,
                help=_('The period of time (in seconds) before token expiration'
                       'when glance_store will try to reques new user token. '
@@ -140,11 +171,88 @@ _SWIFT_OPTS = [
                        'token is used for Swift connection (so no overhead on '
                        'trust creation). Please note that this '
                        'option is considered only and only if '
-                       'swift_store_multi_tenant=True'))
+                       'swift_store_multi_tenant=True')),
+    cfg.IntOpt('swift_store_upload_concurrency', default=1,
+               help=_('The number of segments of a large object that are '
+                      'uploaded to Swift concurrently. When greater than 1, '
+                      'each segment is buffered in memory before it is '
+                      'uploaded, so up to this many times '
+                      'swift_store_large_object_chunk_size of memory may be '
+                      'used per upload. The default of 1 streams segments '
+                      'one at a time without buffering.')),
+    cfg.BoolOpt('swift_store_use_slo', default=False,
+                help=_('If set to True, segmented images are written with a '
+                       'Static Large Object (SLO) manifest that lists the '
+                       'ETag and size of every segment, instead of a Dynamic '
+                       'Large Object (DLO) manifest. Reads of SLO images do '
+                       'not depend on the eventually consistent container '
+                       'listing and they are deleted with a single request. '
+                       'Requires the SLO middleware in the Swift cluster and '
+                       'a swift_store_large_object_chunk_size that respects '
+                       'its minimum segment size.')),
+    cfg.IntOpt('swift_store_delete_concurrency',
+               default=DEFAULT_DELETE_CONCURRENCY,
+               help=_('The number of segments of a Dynamic Large Object that '
+                      'are deleted concurrently when the Swift cluster does '
+                      'not support bulk deletes. Bulk deletes are used '
+                      'whenever the cluster advertises them in /info.')),
+    cfg.IntOpt('swift_store_download_concurrency', default=1,
+               help=_('The number of byte ranges of a segmented or large '
+                      'object that are downloaded from Swift concurrently, '
+                      'each over a connection of its own. Ranges are '
+                      'buffered in memory until they are returned in order, '
+                      'so up to this many times '
+                      'swift_store_download_range_size of memory may be '
+                      'used per download. The default of 1 streams the '
+                      'object with a single request.')),
+    cfg.IntOpt('swift_store_download_range_size',
+               default=DEFAULT_DOWNLOAD_RANGE_SIZE,
+               help=_('The size, in MB, of the byte ranges requested when '
+                      'swift_store_download_concurrency is greater than 1.')),
+    cfg.IntOpt('swift_store_auth_cache_ttl', default=DEFAULT_AUTH_CACHE_TTL,
+               help=_('The number of seconds for which the single tenant '
+                      'store reuses the credentials it got from the auth '
+                      'service: the Keystone client, which refreshes its '
+                      'token as it is about to expire, for auth version 3, '
+                      'and the storage URL and token for older versions. '
+                      'They are shared by all the operations using the same '
+                      'auth address, user, key, region and endpoint type. '
+                      'Set to 0 to authenticate for every operation.')),
+    cfg.IntOpt('swift_store_container_cache_ttl',
+               default=DEFAULT_CONTAINER_CACHE_TTL,
+               help=_('The number of seconds for which a container, once '
+                      'found or created, is known to exist, so that uploads '
+                      'to it do not check for it again. The container is '
+                      'checked again as soon as an upload to it fails '
+                      'because it is missing. Set to 0 to check for the '
+                      'container on every upload.')),
+    cfg.IntOpt('swift_store_upload_session_ttl', default=0,
+               help=_('The number of seconds for which the segments written '
+                      'by a failed upload of a large image are kept, so '
+                      'that a new upload of the same image does not write '
+                      'them again. The segments written so far are recorded '
+                      'in an object next to the image, and a segment is '
+                      'only skipped if the new data has the same size and '
+                      'MD5. The segments of an upload that is not retried '
+                      'in time are deleted by a later upload to the same '
+                      'container. The default of 0 deletes the segments as '
+                      'soon as an upload fails.'))
 ]
 
 
-def swift_retry_iter(resp_iter, length, store, location, manager):
+def swift_retry_iter(resp_iter, length, store, location, manager,
+                     offset=0, end=None, resp_headers=None):
+    """Yield an object body, resuming the download if it is cut short.
+
+    The rest of the object is requested with a Range header, at most
+    ``swift_store_retry_get_count`` times, after an exponential backoff
+    with full jitter. No retry starts once
+    ``swift_store_retry_get_deadline`` seconds have passed. When
+    `resp_headers` are given, the resumed object must still match them.
+
+    :raises: exceptions.BackendException if the object changed or could
+             not be read entirely
+    """
     if not length and isinstance(resp_iter, six.BytesIO):
         if six.PY3:
             # On Python 3, io.BytesIO does not have a len attribute, instead
@@ -159,42 +267,63 @@ def swift_retry_iter(resp_iter, length, store, location, manager):
 
     length = length if length else (resp_iter.len
                                     if hasattr(resp_iter, 'len') else 0)
+    glance_conf = store.conf.glance_store
+    retry_count = glance_conf.swift_store_retry_get_count
+    deadline = None
+    if glance_conf.swift_store_retry_get_deadline > 0:
+        deadline = time.time() + glance_conf.swift_store_retry_get_deadline
     retries = 0
     bytes_read = 0
 
-    while retries <= store.conf.glance_store.swift_store_retry_get_count:
+    while True:
         try:
             for chunk in resp_iter:
                 yield chunk
                 bytes_read += len(chunk)
-        except swiftclient.ClientException as e:
+        except (swiftclient.ClientException, IOError,
+                requests.exceptions.RequestException,
+                urllib3_exceptions.HTTPError) as e:
             LOG.warning(_("Swift exception raised %s")
 
                         % encodeutils.exception_to_unicode(e))
 
-        if bytes_read != length:
-            if retries == store.conf.glance_store.swift_store_retry_get_count:
-                # terminate silently and let higher level decide
-                LOG.error(_("Stopping Swift retries after %d "
-                            "attempts") % retries)
-                break
-            else:
-                retries += 1
-                glance_conf = store.conf.glance_store
-                retry_count = glance_conf.swift_store_retry_get_count
-                LOG.info(_("Retrying Swift connection "
-                           "(%(retries)d/%(max_retries)d) with "
-                           "range=%(start)d-%(end)d") %
-                         {'retries': retries,
-                          'max_retries': retry_count,
-                          'start': bytes_read,
-                          'end': length})
-                (_resp_headers, resp_iter) = store._get_object(location,
-                                                               manager,
-                                                               bytes_read)
-        else:
+        if bytes_read == length or not length:
             break
 
+        delay = gutils.get_retry_backoff(
+            glance_conf.swift_store_retry_get_backoff, retries)
+        out_of_time = deadline is not None and time.time() + delay > deadline
+        if retries >= retry_count or out_of_time:
+            msg = (_("Stopping Swift retries after %(retries)d attempts "
+                     "with %(bytes_read)d of %(length)d bytes of %(obj)s "
+                     "read.") %
+                   {'retries': retries, 'bytes_read': bytes_read,
+                    'length': length, 'obj': location.obj})
+            LOG.error(msg)
+            raise exceptions.BackendException(msg)
+
+        time.sleep(delay)
+        retries += 1
+        LOG.info(_("Retrying Swift connection "
+                   "(%(retries)d/%(max_retries)d) with "
+                   "range=%(start)d-%(end)d") %
+                 {'retries': retries,
+                  'max_retries': retry_count,
+                  'start': offset + bytes_read,
+                  'end': offset + length})
+        try:
+            (new_headers, resp_iter) = store._get_object(
+                location, manager, offset + bytes_read, end)
+        except (swiftclient.ClientException,
+                requests.exceptions.RequestException) as e:
+            LOG.warning(_("Swift exception raised %s")
+                        % encodeutils.exception_to_unicode(e))
+            resp_iter = []
+            continue
+        if resp_headers:
+            gutils.check_resumed_response(location.obj, resp_headers,
+                                          new_headers)
+
 
 class StoreLocation(location.StoreLocation):
 
@@ -430,6 +559,8 @@ class BaseStore(driver.Store):
         self.large_object_size = _obj_size * ONE_MB
         _chunk_size = self._option_get('swift_store_large_object_chunk_size')
         self.large_object_chunk_size = _chunk_size * ONE_MB
+        _range_size = self._option_get('swift_store_download_range_size')
+        self.download_range_size = _range_size * ONE_MB
         self.admin_tenants = glance_conf.swift_store_admin_tenants
         self.region = glance_conf.swift_store_region
         self.service_type = glance_conf.swift_store_service_type
@@ -438,16 +569,22 @@ class BaseStore(driver.Store):
         self.insecure = glance_conf.swift_store_auth_insecure
         self.ssl_compression = glance_conf.swift_store_ssl_compression
         self.cacert = glance_conf.swift_store_cacert
+        self._container_cache = gutils.ExpiringCache(
+            glance_conf.swift_store_container_cache_ttl,
+            max_size=CONTAINER_CACHE_SIZE)
+        self._sessions_swept = {}
         if swiftclient is None:
             msg = _("Missing dependency python_swiftclient.")
             raise exceptions.BadStoreConfiguration(store_name="swift",
                                                    reason=msg)
         super(BaseStore, self).configure(re_raise_bsc=re_raise_bsc)
 
-    def _get_object(self, location, manager, start=None):
+    def _get_object(self, location, manager, start=None, end=None):
         headers = {}
         if start is not None:
             bytes_range = 'bytes=%d-' % start
+            if end is not None:
+                bytes_range += '%d' % end
             headers = {'Range': bytes_range}
 
         try:
@@ -471,23 +608,165 @@ class BaseStore(driver.Store):
         # initialize manager to receive valid connections
         allow_retry = \
             self.conf.glance_store.swift_store_retry_get_count > 0
-        with get_manager_for_store(self, location, context,
-                                   allow_reauth=allow_retry) as manager:
-            (resp_headers, resp_body) = self._get_object(location,
-                                                         manager=manager)
+        manager = get_manager_for_store(self, location, context,
+                                        allow_reauth=allow_retry)
+        resp_body = self._iter_object(location, manager, context=context)
+        # The first item is the size of the object
+        length = next(resp_body)
+
+        class ResponseIndexable(glance_store.Indexable):
+            def another(self):
+                try:
+                    return next(self.wrapped)
+                except StopIteration:
+                    return ''
+
+        return ResponseIndexable(resp_body, length), length
+
+    def _iter_object(self, location, manager, context=None):
+        """Yield the size of an object, then its data.
+
+        `manager` is only exited once the data was read, or the iterator
+        closed, because resumed reads and the ranges of a concurrent
+        download need its connections until then; the multi-tenant manager
+        revokes its trust, and the tokens issued through it, on exit.
+        """
+        glance_conf = self.conf.glance_store
+        allow_retry = glance_conf.swift_store_retry_get_count > 0
+        with manager:
+            if glance_conf.swift_store_download_concurrency > 1:
+                (resp_body, length) = self._get_ranged(location, manager,
+                                                       context=context)
+            else:
+                (resp_headers, resp_body) = self._get_object(
+                    location, manager=manager)
+                length = int(resp_headers.get('content-length', 0))
+                if allow_retry:
+                    resp_body = swift_retry_iter(resp_body, length, self,
+                                                 location, manager=manager,
+                                                 resp_headers=resp_headers)
+            yield length
+            for chunk in resp_body:
+                yield chunk
 
-            class ResponseIndexable(glance_store.Indexable):
-                def another(self):
-                    try:
-                        return next(self.wrapped)
-                    except StopIteration:
-                        return ''
+    def _get_ranged(self, location, manager, context=None):
+        """Start a download of an object as a series of byte ranges.
+
+        The first range is requested right away, and its Content-Range
+        tells the size of the object. Segmented objects and objects of at
+        least ``swift_store_large_object_size`` are read as ranges of
+        ``swift_store_download_range_size`` that are fetched concurrently;
+        the rest of any other object is read with a single request.
+
+        :returns: tuple of (iterator over the object data, object size)
+        """
+        allow_retry = self.conf.glance_store.swift_store_retry_get_count > 0
+        try:
+            (resp_headers, resp_body) = self._get_object(
+                location, manager, 0, self.download_range_size - 1)
+        except swiftclient.ClientException as e:
+            if e.http_status != http_client.REQUESTED_RANGE_NOT_SATISFIABLE:
+                raise
+            # An empty object has no range to satisfy
+            (resp_headers, resp_body) = self._get_object(location, manager)
 
-            length = int(resp_headers.get('content-length', 0))
+        length = int(resp_headers.get('content-length', 0))
+        content_range = resp_headers.get('content-range')
+        if content_range is None:
+            # Swift returned the whole object
             if allow_retry:
                 resp_body = swift_retry_iter(resp_body, length,
-                                             self, location, manager=manager)
-            return ResponseIndexable(resp_body, length), length
+                                             self, location, manager,
+                                             resp_headers=resp_headers)
+            return resp_body, length
+
+        size = int(content_range.rsplit('/', 1)[1])
+        headers = resp_headers
+        if allow_retry:
+            resp_body = swift_retry_iter(resp_body, length, self, location,
+                                         manager, 0, length - 1,
+                                         resp_headers=resp_headers)
+        if length >= size:
+            return resp_body, size
+
+        first = self._iter_range(location, resp_body, 0, length)
+        is_dlo = 'x-object-manifest' in resp_headers
+        is_slo = _is_slo(resp_headers.get('x-static-large-object'))
+        if is_dlo or is_slo or size >= self.large_object_size:
+            return self._iter_ranges(location, manager, first, headers,
+                                     length, size, context=context), size
+
+        def _iter_rest():
+            (resp_headers, resp_body) = self._get_object(location, manager,
+                                                         length)
+            gutils.check_resumed_response(location.obj, headers,
+                                          resp_headers)
+            if allow_retry:
+                resp_body = swift_retry_iter(resp_body, size - length,
+                                             self, location, manager, length,
+                                             resp_headers=resp_headers)
+            for chunk in resp_body:
+                yield chunk
+
+        return itertools.chain(first, _iter_rest()), size
+
+    def _iter_range(self, location, resp_body, start, length):
+        """Yield a range of an object, failing if it is cut short."""
+        bytes_read = 0
+        for chunk in resp_body:
+            bytes_read += len(chunk)
+            yield chunk
+        if bytes_read != length:
+            msg = (_("Got %(bytes_read)d of %(length)d bytes of Swift object "
+                     "%(obj)s from offset %(start)d.") %
+                   {'bytes_read': bytes_read, 'length': length,
+                    'obj': location.obj, 'start': start})
+            LOG.error(msg)
+            raise exceptions.BackendException(msg)
+
+    def _iter_ranges(self, location, manager, first, headers, start, size,
+                     context=None):
+        """Return an iterator over an object, from ranges fetched at once.
+
+        `first` is streamed while the ranges from `start` are fetched by a
+        pool of greenthreads, each over a connection of its own. At most
+        ``swift_store_download_concurrency`` ranges are fetched at once,
+        see `gutils.iter_ranges`. A failed range is retried from where it
+        stopped, like a plain download.
+
+        :param headers: headers of the response `first` comes from, that
+                        every range must match
+        """
+        glance_conf = self.conf.glance_store
+        concurrency = glance_conf.swift_store_download_concurrency
+        allow_retry = glance_conf.swift_store_retry_get_count > 0
+
+        workers = eventlet.queue.LightQueue()
+        for i in range(concurrency):
+            workers.put(connection_manager.WorkerConnectionManager(
+                manager, self, location, context=context))
+
+        def _fetch(range_start, length):
+            range_end = range_start + length - 1
+            worker = workers.get()
+            try:
+                (resp_headers, resp_body) = self._get_object(
+                    location, worker, range_start, range_end)
+                gutils.check_resumed_response(location.obj, headers,
+                                              resp_headers)
+                if allow_retry:
+                    resp_body = swift_retry_iter(resp_body, length, self,
+                                                 location, worker,
+                                                 range_start, range_end,
+                                                 resp_headers=resp_headers)
+                return b''.join(self._iter_range(location, resp_body,
+                                                 range_start, length))
+            finally:
+                workers.put(worker)
+
+        return gutils.iter_ranges(_fetch, start, size,
+                                  self.download_range_size, concurrency,
+                                  self.CHUNKSIZE, first=first)
 
     def get_size(self, location, connection=None, context=None):
         location = location.store_location
@@ -521,6 +800,357 @@ class BaseStore(driver.Store):
                 LOG.exception(msg % {'container': container,
                                      'chunk': chunk})
 
+    def _get_segment_connection(self, manager, location, context=None):
+        """Return a connection of its own for a concurrent segment upload."""
+        worker = connection_manager.WorkerConnectionManager(
+            manager, self, location, context=context)
+        return worker.get_connection()
+
+    def _write_segments(self, manager, location, image_file, image_size,
+                        checksum, verifier=None, context=None):
+        """Write the image into Swift as a series of segments.
+
+        Segments are read from `image_file` in stream order, so `checksum`
+        and `verifier` are always updated in order. When
+        ``swift_store_upload_concurrency`` is greater than one, every
+        segment is buffered in memory and uploaded by a pool of
+        greenthreads, with at most that many segments in flight.
+        On failure all the segments written so far are deleted, unless
+        ``swift_store_upload_session_ttl`` is set: then they are recorded
+        in an upload session, and the segments of a recent session that
+        match the image data are not written again.
+
+        :returns: list of (name, etag, size) tuples, one per segment, in
+                  the order they appear in the image
+        """
+        if image_size > 0:
+            total_chunks = str(int(
+                math.ceil(float(image_size) /
+                          float(self.large_object_chunk_size))))
+        else:
+            # image_size == 0 is when we don't know the size
+            # of the image. This can occur with older clients
+            # that don't inspect the payload size.
+            LOG.debug("Cannot determine image size. Adding as a "
+                      "segmented object to Swift.")
+            total_chunks = '?'
+
+        concurrency = self.conf.glance_store.swift_store_upload_concurrency
+        pool = None
+        if concurrency > 1:
+            pool = eventlet.greenpool.GreenPool(size=concurrency)
+
+        segments = []
+        written_chunks = []
+        failures = []
+        resumable = self.conf.glance_store.swift_store_upload_session_ttl > 0
+        uploaded = {}
+        if resumable:
+            self._sweep_upload_sessions(manager.get_connection(),
+                                        location.container)
+            uploaded = self._load_upload_session(manager.get_connection(),
+                                                 location)
+
+        def _put_segment(index, connection, chunk_name, contents,
+                         content_length):
+            try:
+                chunk_etag = connection.put_object(
+                    location.container, chunk_name, contents,
+                    content_length=content_length)
+            except Exception as e:
+                LOG.exception(_("Error during chunked upload of %s to "
+                                "backend") % chunk_name)
+                failures.append(e)
+                return
+            written_chunks.append(chunk_name)
+            # A streamed ChunkReader only knows its size once it is consumed
+            bytes_read = getattr(contents, 'bytes_read', content_length)
+            segments[index][1:] = [chunk_etag, bytes_read]
+            msg = ("Wrote chunk %(chunk_name)s (%(chunk_id)d/"
+                   "%(total_chunks)s) of length %(bytes_read)d "
+                   "to Swift returning MD5 of content: "
+                   "%(chunk_etag)s" %
+                   {'chunk_name': chunk_name,
+                    'chunk_id': index + 1,
+                    'total_chunks': total_chunks,
+                    'bytes_read': bytes_read,
+                    'chunk_etag': chunk_etag})
+            LOG.debug(msg)
+            if resumable:
+                self._save_upload_session(connection, location, segments)
+
+        chunk_id = 1
+        combined_chunks_size = 0
+        try:
+            while not failures:
+                chunk_size = self.large_object_chunk_size
+                if image_size == 0:
+                    content_length = None
+                else:
+                    left = image_size - combined_chunks_size
+                    if left == 0:
+                        break
+                    if chunk_size > left:
+                        chunk_size = left
+                    content_length = chunk_size
+
+                chunk_name = "%s-%05d" % (location.obj, chunk_id)
+                reader = ChunkReader(image_file, checksum, chunk_size,
+                                     verifier)
+                if reader.is_zero_size is True:
+                    LOG.debug('Not writing zero-length chunk.')
+                    break
+
+                previous = uploaded.get(chunk_name)
+                if pool is None and previous is None:
+                    segments.append([chunk_name, None, 0])
+                    _put_segment(chunk_id - 1, manager.get_connection(),
+                                 chunk_name, reader, content_length)
+                else:
+                    buf = six.BytesIO()
+                    chunk_checksum = hashlib.md5()
+                    while reader.bytes_read < chunk_size:
+                        data = reader.read(chunk_size - reader.bytes_read)
+                        if not data:
+                            break
+                        buf.write(data)
+                        chunk_checksum.update(data)
+                    buf.seek(0)
+                    if previous == (chunk_checksum.hexdigest(),
+                                    reader.bytes_read):
+                        LOG.debug("Chunk %s was written by an earlier upload, "
+                                  "skipping it" % chunk_name)
+                        segments.append([chunk_name] + list(previous))
+                    elif pool is None:
+                        segments.append([chunk_name, None, reader.bytes_read])
+                        _put_segment(chunk_id - 1, manager.get_connection(),
+                                     chunk_name, buf, reader.bytes_read)
+                    else:
+                        segments.append([chunk_name, None, reader.bytes_read])
+                        connection = self._get_segment_connection(
+                            manager, location, context=context)
+                        # NOTE: spawn blocks while the pool is full, which
+                        # bounds the number of segments buffered in memory.
+                        pool.spawn_n(_put_segment, chunk_id - 1, connection,
+                                     chunk_name, buf, reader.bytes_read)
+
+                chunk_id += 1
+                combined_chunks_size += reader.bytes_read
+        except Exception:
+            # Reading the image or verifying it failed
+            with excutils.save_and_reraise_exception():
+                if pool is not None:
+                    pool.waitall()
+                if resumable:
+                    LOG.exception(_("Error during chunked upload to "
+                                    "backend, keeping the chunks written "
+                                    "so far for a new upload"))
+                else:
+                    LOG.exception(_("Error during chunked upload to "
+                                    "backend, deleting stale chunks"))
+                    self._delete_stale_chunks(manager.get_connection(),
+                                              location.container,
+                                              written_chunks)
+
+        if pool is not None:
+            pool.waitall()
+
+        if failures and resumable:
+            LOG.error(_("Error during chunked upload to backend, keeping "
+                        "the chunks written so far for a new upload"))
+            raise failures[0]
+
+        if failures:
+            # Delete orphaned segments from swift backend
+            LOG.error(_("Error during chunked upload to backend, deleting "
+                        "stale chunks"))
+            self._delete_stale_chunks(manager.get_connection(),
+                                      location.container,
+                                      written_chunks)
+            raise failures[0]
+
+        # A DLO would also serve the chunks of an earlier, longer upload
+        names = set(segment[0] for segment in segments)
+        self._delete_segments(manager.get_connection(), location.container,
+                              sorted(name for name in uploaded
+                                     if name not in names))
+
+        return [tuple(segment) for segment in segments]
+
+    def _get_upload_session_name(self, obj):
+        # NOTE: Sessions share a prefix so that they can be listed, which
+        # must not be the prefix of the DLO manifest of any image
+        return UPLOAD_SESSION_PREFIX + obj
+
+    def _parse_upload_session(self, body):
+        """Return the segments, update time and chunk size of a session.
+
+        :raises: ValueError if the session is malformed
+        """
+        try:
+            session = jsonutils.loads(body)
+            segments = dict((name, (etag, size))
+                            for name, etag, size in session['segments'])
+            return (segments, float(session['updated']),
+                    int(session['chunk_size']))
+        except (KeyError, TypeError) as e:
+            raise ValueError(e)
+
+    def _load_upload_session(self, connection, location):
+        """Return the segments recorded by an earlier upload of the image.
+
+        Sessions older than ``swift_store_upload_session_ttl``, written
+        with another chunk size or malformed are deleted along with their
+        segments.
+
+        :returns: dict of segment name to (etag, size)
+        """
+        session_name = self._get_upload_session_name(location.obj)
+        try:
+            _headers, body = connection.get_object(location.container,
+                                                   session_name)
+        except swiftclient.ClientException as e:
+            if e.http_status != http_client.NOT_FOUND:
+                LOG.warning(_("Cannot read upload session %(name)s: "
+                              "%(error)s") %
+                            {'name': session_name,
+                             'error': encodeutils.exception_to_unicode(e)})
+            return {}
+
+        ttl = self.conf.glance_store.swift_store_upload_session_ttl
+        try:
+            segments, updated, chunk_size = self._parse_upload_session(body)
+        except ValueError:
+            LOG.warning(_("Upload session %s is malformed") % session_name)
+            expired = True
+        else:
+            expired = updated + ttl < time.time()
+            expired |= chunk_size != self.large_object_chunk_size
+        if expired:
+            self._discard_upload_session(connection, location.container,
+                                         location.obj)
+            return {}
+
+        LOG.info(_LI("Resuming the upload of %(obj)s with %(count)d chunks "
+                     "written") % {'obj': location.obj,
+                                   'count': len(segments)})
+        return segments
+
+    def _discard_upload_session(self, connection, container, obj):
+        """Delete the upload session of an image and its segments."""
+        LOG.info(_LI("Discarding the upload session of %s") % obj)
+        segments = connection.get_container(container, prefix=obj + '-',
+                                            full_listing=True)[1]
+        self._delete_segments(connection, container,
+                              [segment['name'] for segment in segments])
+        self._delete_upload_session(connection, container, obj)
+
+    def _sweep_upload_sessions(self, connection, container):
+        """Discard the expired upload sessions of a container.
+
+        Without this, the segments of an upload that is never retried would
+        stay in Swift. A container is swept at most once per
+        ``swift_store_upload_session_ttl`` by each process.
+        """
+        ttl = self.conf.glance_store.swift_store_upload_session_ttl
+        now = time.time()
+        if self._sessions_swept.get(container, 0) + ttl > now:
+            return
+        self._sessions_swept[container] = now
+
+        try:
+            sessions = connection.get_container(
+                container, prefix=UPLOAD_SESSION_PREFIX,
+                full_listing=True)[1]
+            for entry in sessions:
+                obj = entry['name'][len(UPLOAD_SESSION_PREFIX):]
+                _headers, body = connection.get_object(container,
+                                                       entry['name'])
+                try:
+                    updated = self._parse_upload_session(body)[1]
+                except ValueError:
+                    updated = 0
+                if updated + ttl >= now:
+                    continue
+                try:
+                    connection.head_object(container, obj)
+                except swiftclient.ClientException as e:
+                    if e.http_status != http_client.NOT_FOUND:
+                        raise
+                    self._discard_upload_session(connection, container, obj)
+                else:
+                    # The upload completed, but its session was not deleted
+                    self._delete_upload_session(connection, container, obj)
+        except Exception as e:
+            LOG.warning(_("Failed to discard the expired upload sessions of "
+                          "container %(container)s: %(error)s") %
+                        {'container': container,
+                         'error': encodeutils.exception_to_unicode(e)})
+
+    def _save_upload_session(self, connection, location, segments):
+        """Record the segments written so far by an upload."""
+        session = {'updated': time.time(),
+                   'chunk_size': self.large_object_chunk_size,
+                   'segments': [segment for segment in segments
+                                if segment[1] is not None]}
+        try:
+            connection.put_object(location.container,
+                                  self._get_upload_session_name(location.obj),
+                                  jsonutils.dumps(session),
+                                  content_type='application/json')
+        except Exception:
+            LOG.exception(_("Failed to record the upload session of %s") %
+                          location.obj)
+
+    def _delete_upload_session(self, connection, container, obj):
+        try:
+            connection.delete_object(container,
+                                     self._get_upload_session_name(obj))
+        except swiftclient.ClientException as e:
+            if e.http_status != http_client.NOT_FOUND:
+                LOG.warning(_("Failed to delete the upload session of "
+                              "%(obj)s: %(error)s") %
+                            {'obj': obj,
+                             'error': encodeutils.exception_to_unicode(e)})
+
+    def _put_dlo_manifest(self, connection, location):
+        """Write a Dynamic Large Object manifest for the image segments."""
+        manifest = "%s/%s-" % (location.container, location.obj)
+        headers = {'ETag': hashlib.md5(b"").hexdigest(),
+                   'X-Object-Manifest': manifest}
+        connection.put_object(location.container, location.obj,
+                              None, headers=headers)
+
+    def _put_slo_manifest(self, connection, location, segments):
+        """Write a Static Large Object manifest for the image segments.
+
+        The manifest lists every segment with its ETag and size, so reads
+        of the image do not depend on the container listing and the image
+        can be deleted with a single request. If the cluster refuses the
+        manifest, for instance because SLO is not enabled or its segment
+        limits are exceeded, a DLO manifest is written instead.
+
+        :param segments: list of (name, etag, size) tuples, in order
+        """
+        manifest = [{'path': '/%s/%s' % (location.container, name),
+                     'etag': etag,
+                     'size_bytes': size}
+                    for name, etag, size in segments]
+        try:
+            connection.put_object(location.container, location.obj,
+                                  jsonutils.dumps(manifest),
+                                  query_string='multipart-manifest=put')
+        except swiftclient.ClientException as e:
+            if e.http_status not in (http_client.BAD_REQUEST,
+                                     http_client.REQUEST_ENTITY_TOO_LARGE):
+                raise
+            LOG.warning(_("Swift refused the static large object manifest "
+                          "for %(obj)s, writing a dynamic large object "
+                          "manifest instead: %(err)s") %
+                        {'obj': location.obj,
+                         'err': encodeutils.exception_to_unicode(e)})
+            self._put_dlo_manifest(connection, location)
+
     @capabilities.check
     def add(self, image_id, image_file, image_size,
             context=None, verifier=None):
@@ -553,70 +1183,13 @@ class BaseStore(driver.Store):
                             image_file, content_length=image_size)
                 else:
                     # Write the image into Swift in chunks.
-                    chunk_id = 1
-                    if image_size > 0:
-                        total_chunks = str(int(
-                            math.ceil(float(image_size) /
-                                      float(self.large_object_chunk_size))))
-                    else:
-                        # image_size == 0 is when we don't know the size
-                        # of the image. This can occur with older clients
-                        # that don't inspect the payload size.
-                        LOG.debug("Cannot determine image size. Adding as a "
-                                  "segmented object to Swift.")
-                        total_chunks = '?'
-
                     checksum = hashlib.md5()
-                    written_chunks = []
-                    combined_chunks_size = 0
-                    while True:
-                        chunk_size = self.large_object_chunk_size
-                        if image_size == 0:
-                            content_length = None
-                        else:
-                            left = image_size - combined_chunks_size
-                            if left == 0:
-                                break
-                            if chunk_size > left:
-                                chunk_size = left
-                            content_length = chunk_size
-
-                        chunk_name = "%s-%05d" % (location.obj, chunk_id)
-                        reader = ChunkReader(image_file, checksum, chunk_size,
-                                             verifier)
-                        if reader.is_zero_size is True:
-                            LOG.debug('Not writing zero-length chunk.')
-                            break
-                        try:
-                            chunk_etag = manager.get_connection().put_object(
-                                location.container, chunk_name, reader,
-                                content_length=content_length)
-                            written_chunks.append(chunk_name)
-                        except Exception:
-                            # Delete orphaned segments from swift backend
-                            with excutils.save_and_reraise_exception():
-                                LOG.exception(_("Error during chunked upload "
-                                                "to backend, deleting stale "
-                                                "chunks"))
-                                self._delete_stale_chunks(
-                                    manager.get_connection(),
-                                    location.container,
-                                    written_chunks)
-
-                        bytes_read = reader.bytes_read
-                        msg = ("Wrote chunk %(chunk_name)s (%(chunk_id)d/"
-                               "%(total_chunks)s) of length %(bytes_read)d "
-                               "to Swift returning MD5 of content: "
-                               "%(chunk_etag)s" %
-                               {'chunk_name': chunk_name,
-                                'chunk_id': chunk_id,
-                                'total_chunks': total_chunks,
-                                'bytes_read': bytes_read,
-                                'chunk_etag': chunk_etag})
-                        LOG.debug(msg)
-
-                        chunk_id += 1
-                        combined_chunks_size += bytes_read
+                    segments = self._write_segments(manager, location,
+                                                    image_file, image_size,
+                                                    checksum, verifier,
+                                                    context=context)
+                    combined_chunks_size = sum(size for _name, _etag, size
+                                               in segments)
 
                     # In the case we have been given an unknown image size,
                     # set the size to the total size of the combined chunks.
@@ -625,18 +1198,22 @@ class BaseStore(driver.Store):
 
                     # Now we write the object manifest and return the
                     # manifest's etag...
-                    manifest = "%s/%s-" % (location.container, location.obj)
-                    headers = {'ETag': hashlib.md5(b"").hexdigest(),
-                               'X-Object-Manifest': manifest}
-
                     # The ETag returned for the manifest is actually the
                     # MD5 hash of the concatenated checksums of the strings
                     # of each chunk...so we ignore this result in favour of
                     # the MD5 of the entire image file contents, so that
                     # users can verify the image file contents accordingly
-                    manager.get_connection().put_object(location.container,
-                                                        location.obj,
-                                                        None, headers=headers)
+                    if self.conf.glance_store.swift_store_use_slo:
+                        self._put_slo_manifest(manager.get_connection(),
+                                               location, segments)
+                    else:
+                        self._put_dlo_manifest(manager.get_connection(),
+                                               location)
+                    glance_conf = self.conf.glance_store
+                    if glance_conf.swift_store_upload_session_ttl > 0:
+                        self._delete_upload_session(manager.get_connection(),
+                                                    location.container,
+                                                    location.obj)
                     obj_etag = checksum.hexdigest()
 
                 # NOTE: We return the user and key here! Have to because
@@ -654,6 +1231,10 @@ class BaseStore(driver.Store):
                 if e.http_status == http_client.CONFLICT:
                     msg = _("Swift already has an image at this location")
                     raise exceptions.Duplicate(message=msg)
+                if e.http_status == http_client.NOT_FOUND:
+                    # the container went away since it was last seen
+                    self._container_cache.pop(
+                        (manager.get_connection().url, location.container))
 
                 msg = (_(u"Failed to add object to Swift.\n"
                          "Got error from Swift: %s.")
@@ -695,18 +1276,9 @@ class BaseStore(driver.Store):
                 obj_container, obj_prefix = dlo_manifest.split('/', 1)
                 segments = connection.get_container(
                     obj_container, prefix=obj_prefix)[1]
-                for segment in segments:
-                    # TODO(jaypipes): This would be an easy area to parallelize
-                    # since we're simply sending off parallelizable requests
-                    # to Swift to delete stuff. It's not like we're going to
-                    # be hogging up network or file I/O here...
-                    try:
-                        connection.delete_object(obj_container,
-                                                 segment['name'])
-                    except swiftclient.ClientException as e:
-                        msg = _('Unable to delete segment %(segment_name)s')
-                        msg = msg % {'segment_name': segment['name']}
-                        LOG.exception(msg)
+                self._delete_segments(connection, obj_container,
+                                      [segment['name']
+                                       for segment in segments])
 
             # Delete object (or, in segmented case, the manifest)
             connection.delete_object(location.container, location.obj)
@@ -718,6 +1290,131 @@ class BaseStore(driver.Store):
             else:
                 raise
 
+    def _get_swift_info(self, connection):
+        """Return the capabilities advertised in /info by the cluster.
+
+        Results are cached per storage URL. Clusters that do not answer
+        are treated as advertising no capabilities.
+        """
+        info = _SWIFT_INFO_CACHE.get(connection.url)
+        if info is None:
+            try:
+                info = connection.get_capabilities()
+            except Exception as e:
+                LOG.debug("Unable to retrieve Swift capabilities: %s",
+                          encodeutils.exception_to_unicode(e))
+                info = {}
+            if connection.url:
+                _SWIFT_INFO_CACHE.set(connection.url, info)
+        return info
+
+    def _delete_segments(self, connection, container, segment_names):
+        """Delete the segments of a Dynamic Large Object.
+
+        Uses the bulk delete middleware when the cluster advertises it,
+        otherwise deletes the segments concurrently. Segments that cannot
+        be deleted are logged and otherwise ignored, so the manifest can
+        still be removed.
+        """
+        if not segment_names:
+            return
+
+        failed = None
+        bulk_info = self._get_swift_info(connection).get('bulk_delete')
+        if bulk_info is not None:
+            try:
+                failed = self._bulk_delete(connection, container,
+                                           segment_names, bulk_info)
+            except Exception:
+                LOG.exception(_("Bulk delete of the segments in %s failed, "
+                                "deleting them one by one") % container)
+        if failed is None:
+            failed = self._delete_objects(connection, container,
+                                          segment_names)
+
+        if failed:
+            msg = _("Failed to delete %(failed)d of %(total)d segments in "
+                    "%(container)s: %(names)s")
+            LOG.warning(msg % {'failed': len(failed),
+                               'total': len(segment_names),
+                               'container': container,
+                               'names': ', '.join(failed)})
+
+    def _bulk_delete(self, connection, container, object_names, bulk_info):
+        """Delete objects with the Swift bulk delete middleware.
+
+        :returns: list of the names of the objects that were not deleted
+        """
+        max_deletes = bulk_info.get('max_deletes_per_request',
+                                    DEFAULT_MAX_BULK_DELETES)
+        headers = {'Accept': 'application/json',
+                   'Content-Type': 'text/plain'}
+        failed = []
+        for i in range(0, len(object_names), max_deletes):
+            batch = object_names[i:i + max_deletes]
+            body = '\n'.join(urllib.parse.quote(
+                encodeutils.safe_encode('/%s/%s' % (container, name)))
+                for name in batch)
+            _resp_headers, resp_body = connection.post_account(
+                headers=headers, data=body, query_string='bulk-delete')
+            result = jsonutils.loads(resp_body)
+            errors = result.get('Errors') or []
+            status = result.get('Response Status', '200 OK')
+            if not errors and not status.startswith('2'):
+                raise glance_store.BackendException(
+                    result.get('Response Body') or status)
+            for path, error in errors:
+                LOG.error(_('Unable to delete segment %(segment_name)s: '
+                            '%(error)s') % {'segment_name': path,
+                                            'error': error})
+                failed.append(urllib.parse.unquote(path).rsplit('/', 1)[-1])
+        return failed
+
+    def _delete_objects(self, connection, container, object_names):
+        """Delete objects with one request each, several at a time.
+
+        Every worker gets a connection of its own that reuses the token of
+        `connection`. An unauthenticated connection cannot be cloned, so
+        in that case the objects are deleted one after the other through
+        `connection` itself.
+
+        :returns: list of the names of the objects that were not deleted
+        """
+        def _delete(conn, name):
+            try:
+                conn.delete_object(container, name)
+            except swiftclient.ClientException as e:
+                if e.http_status == http_client.NOT_FOUND:
+                    return True
+                msg = _('Unable to delete segment %(segment_name)s')
+                LOG.exception(msg % {'segment_name': name})
+                return False
+            return True
+
+        glance_conf = self.conf.glance_store
+        concurrency = min(glance_conf.swift_store_delete_concurrency,
+                          len(object_names))
+        if concurrency <= 1 or not (connection.url and connection.token):
+            return [name for name in object_names
+                    if not _delete(connection, name)]
+
+        connections = eventlet.queue.LightQueue()
+        for i in range(concurrency):
+            connections.put(self.get_store_connection(connection.token,
+                                                      connection.url))
+
+        def _pooled_delete(name):
+            conn = connections.get()
+            try:
+                return _delete(conn, name)
+            finally:
+                connections.put(conn)
+
+        pool = eventlet.greenpool.GreenPool(size=concurrency)
+        results = pool.imap(_pooled_delete, object_names)
+        return [name for name, deleted in zip(object_names, results)
+                if not deleted]
+
     def _create_container_if_missing(self, container, connection):
         """
         Creates a missing container in Swift if the
@@ -726,6 +1423,11 @@ class BaseStore(driver.Store):
         :param container: Name of container to create
         :param connection: Connection to swift service
         """
+        # the storage URL is only known once the connection authenticated
+        cache_key = (connection.url, container)
+        if connection.url and self._container_cache.get(cache_key):
+            return
+
         try:
             connection.head_container(container)
         except swiftclient.ClientException as e:
@@ -751,6 +1453,9 @@ class BaseStore(driver.Store):
             else:
                 raise
 
+        if connection.url:
+            self._container_cache.set((connection.url, container), True)
+
     def get_connection(self, location, context=None):
         raise NotImplementedError()
 
@@ -801,6 +1506,9 @@ class SingleTenantStore(BaseStore):
         self.user_domain_name = None
         self.project_domain_id = None
         self.project_domain_name = None
+        ttl = self.conf.glance_store.swift_store_auth_cache_ttl
+        self._auth_cache = gutils.ExpiringCache(ttl)
+        self._client_cache = gutils.ExpiringCache(ttl)
 
         super(SingleTenantStore, self).configure(re_raise_bsc=re_raise_bsc)
 
@@ -881,6 +1589,19 @@ class SingleTenantStore(BaseStore):
         else:
             return default_image_container
 
+    def _get_auth_cache_key(self, location):
+        auth_url = location.swift_url
+        if not auth_url.endswith('/'):
+            auth_url += '/'
+        return (auth_url, location.user, location.key, self.region,
+                self.endpoint_type)
+
+    def _cache_auth(self, location, connection):
+        """Remember the storage URL and token a connection got."""
+        if connection.url and connection.token:
+            self._auth_cache.set(self._get_auth_cache_key(location),
+                                 (connection.url, connection.token))
+
     def get_connection(self, location, context=None):
         if not location.user:
             reason = _("Location is missing user:password information.")
@@ -917,8 +1638,13 @@ class SingleTenantStore(BaseStore):
         if self.project_domain_name:
             os_options['project_domain_name'] = self.project_domain_name
 
+        # swiftclient authenticates again if the cached token was revoked
+        storage_url, auth_token = self._auth_cache.get(
+            self._get_auth_cache_key(location), (None, None))
         return swiftclient.Connection(
-            auth_url, user, location.key, preauthurl=self.conf_endpoint,
+            auth_url, user, location.key,
+            preauthurl=self.conf_endpoint or storage_url,
+            preauthtoken=auth_token,
             insecure=self.insecure, tenant_name=tenant_name,
             auth_version=self.auth_version, os_options=os_options,
             ssl_compression=self.ssl_compression, cacert=self.cacert)
@@ -943,6 +1669,13 @@ class SingleTenantStore(BaseStore):
             LOG.info(reason)
             raise exceptions.BadStoreUri(message=reason)
 
+        # the client keeps its token until it is about to expire, so a
+        # client shared between operations saves a round trip to Keystone
+        cache_key = self._get_auth_cache_key(location)
+        client = self._client_cache.get(cache_key)
+        if client is not None:
+            return client
+
         # initialize a keystone plugin for swift admin with creds
         password = ks_v3.Password(auth_url=auth_url,
                                   username=user,
@@ -954,7 +1687,9 @@ class SingleTenantStore(BaseStore):
                                   project_domain_name=self.project_domain_name)
         sess = ks_session.Session(auth=password)
 
-        return ks_client.Client(session=sess)
+        client = ks_client.Client(session=sess)
+        self._client_cache.set(cache_key, client)
+        return client
 
 
 class MultiTenantStore(BaseStore):
@@ -18,7 +18,10 @@
 import hashlib
 import logging
 import os
+import threading
+import time
 
+import eventlet
 from oslo_config import cfg
 from oslo_utils import excutils
 from oslo_utils import netutils
@@ -53,7 +56,12 @@ from glance_store import location
 
 LOG = logging.getLogger(__name__)
 
-CHUNKSIZE = 1024 * 64  # 64kB
+DEFAULT_UPLOAD_CHUNK_SIZE = 1024  # 1MB
+DEFAULT_SESSION_CHECK_INTERVAL = 60
+DEFAULT_FREESPACE_CACHE_TTL = 60
+# A cached free space is queried again when an image would fill more than
+# this share of it
+FREESPACE_NEAR_FULL_RATIO = 0.9
 MAX_REDIRECTS = 5
 DEFAULT_STORE_IMAGE_DIR = '/openstack_glance'
 DS_URL_PREFIX = '/folder'
@@ -95,6 +103,25 @@ _VMWARE_OPTS = [
     cfg.StrOpt('vmware_ca_file',
                help=_('Specify a CA bundle file to use in verifying the '
                       'ESX/vCenter server certificate.')),
+    cfg.IntOpt('vmware_upload_chunk_size',
+               default=DEFAULT_UPLOAD_CHUNK_SIZE,
+               help=_('The size, in KB, of the blocks in which image data is '
+                      'read and sent to the datastore during an upload.')),
+    cfg.IntOpt('vmware_session_check_interval',
+               default=DEFAULT_SESSION_CHECK_INTERVAL,
+               help=_('The number of seconds for which a session with the '
+                      'ESX/vCenter server that was found active is trusted '
+                      'before uploads check it again. Set to 0 to check '
+                      'the session before every upload.')),
+    cfg.IntOpt('vmware_freespace_cache_ttl',
+               default=DEFAULT_FREESPACE_CACHE_TTL,
+               help=_('The number of seconds after which the free space of '
+                      'a datastore, used to select where an image is '
+                      'stored, is refreshed in the background. Uploads in '
+                      'progress are subtracted from it, and it is queried '
+                      'again before an image that would nearly fill it is '
+                      'placed there. Set to 0 to query the free space of '
+                      'every datastore on every upload.')),
     cfg.MultiStrOpt(
         'vmware_datastores',
         help=_(
@@ -114,22 +141,6 @@ _VMWARE_OPTS = [
             'selected.'))]
 
 
-def http_response_iterator(conn, response, size):
-    """Return an iterator for a file-like object.
-
-    :param conn: HTTP(S) Connection
-    :param response: http_client.HTTPResponse object
-    :param size: Chunk size to iterate with
-    """
-    try:
-        chunk = response.read(size)
-        while chunk:
-            yield chunk
-            chunk = response.read(size)
-    finally:
-        conn.close()
-
-
 class _Reader(object):
 
     def __init__(self, data, verifier=None):
@@ -151,6 +162,33 @@ class _Reader(object):
         return self._size
 
 
+class _BufferedReader(object):
+    """Read a file-like object in blocks of at least `chunk_size` bytes.
+
+    http_client sends a request body in small reads; buffering them keeps
+    the reads from the image data, and the checksum updates, large.
+    """
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.chunk_size = chunk_size
+        self._buffer = b''
+        self._pos = 0
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            result = self._buffer[self._pos:] + self.data.read()
+            self._buffer = b''
+            self._pos = 0
+            return result
+        if self._pos >= len(self._buffer):
+            self._buffer = self.data.read(max(size, self.chunk_size))
+            self._pos = 0
+        result = self._buffer[self._pos:self._pos + size]
+        self._pos += len(result)
+        return result
+
+
 class StoreLocation(location.StoreLocation):
     """Class describing an VMware URI.
 
@@ -232,7 +270,8 @@ class StoreLocation(location.StoreLocation):
 class Store(glance_store.Store):
     """An implementation of the VMware datastore adapter."""
 
-    _CAPABILITIES = (capabilities.BitMasks.RW_ACCESS |
+    _CAPABILITIES = (capabilities.BitMasks.READ_RANDOM |
+                     capabilities.BitMasks.WRITE_ACCESS |
                      capabilities.BitMasks.DRIVER_REUSABLE)
     OPTIONS = _VMWARE_OPTS
     WRITE_CHUNKSIZE = units.Mi
@@ -240,6 +279,12 @@ class Store(glance_store.Store):
     def __init__(self, conf):
         super(Store, self).__init__(conf)
         self.datastores = {}
+        self.http_session = None
+        self._session_checked_at = None
+        self._freespace = {}
+        self._reservations = {}
+        self._refreshing = set()
+        self._freespace_lock = threading.Lock()
 
     def reset_session(self):
         self.session = api.VMwareAPISession(
@@ -247,6 +292,7 @@ class Store(glance_store.Store):
             self.api_retry_count, self.tpoll_interval,
             cacert=self.ca_file,
             insecure=self.api_insecure)
+        self._session_checked_at = None
         return self.session
 
     def get_schemes(self):
@@ -280,6 +326,7 @@ class Store(glance_store.Store):
             raise exceptions.BadStoreConfiguration(
                 store_name="vmware_datastore", reason=msg)
         self.session = self.reset_session()
+        self.http_session = new_session(self.api_insecure, self.ca_file)
         super(Store, self).configure(re_raise_bsc=re_raise_bsc)
 
     def _get_datacenter(self, datacenter_path):
@@ -315,6 +362,80 @@ class Store(glance_store.Store):
             vim_util, 'get_object_property', self.session.vim, ds_obj.ref,
             'summary.freeSpace')
 
+    @staticmethod
+    def _get_freespace_key(ds_obj):
+        return ds_obj.datacenter.path, ds_obj.name
+
+    def _update_freespace(self, ds_obj):
+        freespace = self._get_freespace(ds_obj)
+        with self._freespace_lock:
+            self._freespace[self._get_freespace_key(ds_obj)] = (freespace,
+                                                                time.time())
+        return freespace
+
+    def _refresh_freespace(self, ds_obj):
+        key = self._get_freespace_key(ds_obj)
+        try:
+            self._update_freespace(ds_obj)
+        except Exception as e:
+            LOG.warning(_("Failed to refresh the free space of datastore "
+                          "%(ds)s: %(error)s") % {'ds': ds_obj.name,
+                                                  'error': e})
+        finally:
+            with self._freespace_lock:
+                self._refreshing.discard(key)
+
+    def _get_cached_freespace(self, ds_obj, image_size):
+        """Return the free space of a datastore, less uploads in progress.
+
+        The free space is cached and refreshed in the background once it
+        is older than ``vmware_freespace_cache_ttl`` seconds. It is queried
+        right away when the image would nearly fill the cached value.
+        """
+        ttl = self.conf.glance_store.vmware_freespace_cache_ttl
+        key = self._get_freespace_key(ds_obj)
+        with self._freespace_lock:
+            cached = self._freespace.get(key)
+            reserved = self._reservations.get(key, 0)
+
+        if ttl <= 0 or cached is None:
+            return self._update_freespace(ds_obj) - reserved
+
+        freespace, updated_at = cached
+        if image_size > (freespace - reserved) * FREESPACE_NEAR_FULL_RATIO:
+            return self._update_freespace(ds_obj) - reserved
+
+        if time.time() - updated_at >= ttl:
+            with self._freespace_lock:
+                refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            if refresh:
+                eventlet.spawn_n(self._refresh_freespace, ds_obj)
+        return freespace - reserved
+
+    def _reserve_freespace(self, ds_obj, size):
+        key = self._get_freespace_key(ds_obj)
+        with self._freespace_lock:
+            self._reservations[key] = self._reservations.get(key, 0) + size
+
+    def _release_freespace(self, ds_obj, size):
+        key = self._get_freespace_key(ds_obj)
+        with self._freespace_lock:
+            reserved = self._reservations.get(key, 0) - size
+            if reserved > 0:
+                self._reservations[key] = reserved
+            else:
+                self._reservations.pop(key, None)
+
+    def _consume_freespace(self, ds_obj, size):
+        """Deduct an image written to a datastore from its cached free space.
+        """
+        key = self._get_freespace_key(ds_obj)
+        with self._freespace_lock:
+            cached = self._freespace.get(key)
+            if cached is not None:
+                self._freespace[key] = (cached[0] - size, cached[1])
+
     def _parse_datastore_info_and_weight(self, datastore):
         weight = 0
         parts = [part.strip() for part in datastore.rsplit(":", 2)]
@@ -379,7 +500,7 @@ class Store(glance_store.Store):
             max_fs = 0
             for ds in v:
                 # Update with current freespace
-                ds.freespace = self._get_freespace(ds)
+                ds.freespace = self._get_cached_freespace(ds, image_size)
                 if ds.freespace > max_fs:
                     max_ds = ds
                     max_fs = ds.freespace
@@ -399,10 +520,23 @@ class Store(glance_store.Store):
                 store_name='vmware_datastore', reason=reason)
         return result
 
+    def _session_recently_checked(self):
+        interval = self.conf.glance_store.vmware_session_check_interval
+        if self._session_checked_at is None or interval <= 0:
+            return False
+        return time.time() - self._session_checked_at < interval
+
     def _build_vim_cookie_header(self, verify_session=False):
-        """Build ESX host session cookie header."""
-        if verify_session and not self.session.is_current_session_active():
-            self.reset_session()
+        """Build ESX host session cookie header.
+
+        A session found active is trusted for
+        ``vmware_session_check_interval`` seconds without checking it again.
+        """
+        if verify_session and not self._session_recently_checked():
+            if self.session.is_current_session_active():
+                self._session_checked_at = time.time()
+            else:
+                self.reset_session()
         vim_cookies = self.session.vim.client.options.transport.cookiejar
         if len(list(vim_cookies)) > 0:
             cookie = list(vim_cookies)[0]
@@ -429,12 +563,13 @@ class Store(glance_store.Store):
         """
         ds = self.select_datastore(image_size)
         image_file = _Reader(image_file, verifier)
+        chunk_size = self.conf.glance_store.vmware_upload_chunk_size * units.Ki
         headers = {}
         if image_size > 0:
             headers.update({'Content-Length': image_size})
-            data = image_file
+            data = _BufferedReader(image_file, chunk_size)
         else:
-            data = utils.chunkiter(image_file, CHUNKSIZE)
+            data = utils.chunkiter(image_file, chunk_size)
         loc = StoreLocation({'scheme': self.scheme,
                              'server_host': self.server_host,
                              'image_dir': self.store_image_dir,
@@ -445,11 +580,11 @@ class Store(glance_store.Store):
         cookie = self._build_vim_cookie_header(True)
         headers = dict(headers)
         headers.update({'Cookie': cookie})
-        session = new_session(self.api_insecure, self.ca_file)
 
         url = loc.https_url
+        self._reserve_freespace(ds, image_size)
         try:
-            response = session.put(url, data=data, headers=headers)
+            response = self.http_session.put(url, data=data, headers=headers)
         except IOError as e:
             # TODO(sigmavirus24): Figure out what the new exception type would
             # be in requests.
@@ -470,6 +605,8 @@ class Store(glance_store.Store):
             with excutils.save_and_reraise_exception():
                 LOG.exception(_LE('Failed to upload content of image '
                                   '%(image)s'), {'image': image_id})
+        finally:
+            self._release_freespace(ds, image_size)
 
         res = response.raw
         if res.status == requests.codes.conflict:
@@ -487,6 +624,7 @@ class Store(glance_store.Store):
             LOG.error(msg)
             raise exceptions.BackendException(msg)
 
+        self._consume_freespace(ds, image_file.size)
         return (loc.get_uri(), image_file.size,
                 image_file.checksum.hexdigest(), {})
 
@@ -498,9 +636,24 @@ class Store(glance_store.Store):
 
         :param location: `glance_store.location.Location` object, supplied
                         from glance_store.location.get_location_from_uri()
+        :param offset: offset to start reading
+        :param chunk_size: size to read, or None to get all the image
         """
-        conn, resp, content_length = self._query(location, 'GET')
-        iterator = http_response_iterator(conn, resp, self.READ_CHUNKSIZE)
+        headers = None
+        if offset or chunk_size is not None:
+            headers = {'Range': utils.get_range_header(offset, chunk_size)}
+        conn, resp, content_length = self._query(location, 'GET',
+                                                 headers=headers)
+        skip = 0
+        if headers and resp.status != requests.codes.partial_content:
+            # NOTE: The whole file was returned, so skip to the requested
+            # offset and stop after chunk_size bytes on our side.
+            skip = offset
+            content_length = max(content_length - offset, 0)
+            if chunk_size is not None:
+                content_length = min(content_length, chunk_size)
+        iterator = self._iter_response(location, conn, offset=offset,
+                                       length=content_length, skip=skip)
 
         class ResponseIndexable(glance_store.Indexable):
 
@@ -512,6 +665,20 @@ class Store(glance_store.Store):
 
         return (ResponseIndexable(iterator, content_length), content_length)
 
+    def _iter_response(self, location, conn, offset=0, length=0, skip=0):
+        """Yield the body of a response, resuming it if it is cut short.
+
+        The rest of the file is requested with a Range header, at most
+        ``vmware_api_retry_count`` times.
+        """
+        def _query(range_header):
+            return self._query(location, 'GET',
+                               headers={'Range': range_header})[0]
+
+        return utils.http_retry_iterator(
+            _query, location.store_location.path, conn, self.READ_CHUNKSIZE,
+            self.api_retry_count, offset=offset, length=length, skip=skip)
+
     def get_size(self, location, context=None):
         """Takes a `glance_store.location.Location` object that indicates
         where to find the image file, and returns the size
@@ -559,15 +726,16 @@ class Store(glance_store.Store):
                 LOG.exception(_LE('Failed to delete image %(image)s '
                                   'content.') % {'image': location.image_id})
 
-    def _query(self, location, method):
-        session = new_session(self.api_insecure, self.ca_file)
+    def _query(self, location, method, headers=None):
+        session = self.http_session
         loc = location.store_location
         redirects_followed = 0
         # TODO(sabari): The redirect logic was added to handle cases when the
         # backend redirects http url's to https. But the store never makes a
         # http request and hence this can be safely removed.
         while redirects_followed < MAX_REDIRECTS:
-            conn, resp = self._retry_request(session, method, location)
+            conn, resp = self._retry_request(session, method, location,
+                                             headers=headers)
 
             # NOTE(sigmavirus24): _retry_request handles 4xx and 5xx errors so
             # if the response is not a redirect, we can return early.
@@ -597,14 +765,15 @@ class Store(glance_store.Store):
 
         return (conn, resp, content_length)
 
-    def _retry_request(self, session, method, location):
+    def _retry_request(self, session, method, location, headers=None):
         loc = location.store_location
         # NOTE(arnaud): use a decorator when the config is not tied to self
         for i in range(self.api_retry_count + 1):
             cookie = self._build_vim_cookie_header()
-            headers = {'Cookie': cookie}
-            conn = session.request(method, loc.https_url, headers=headers,
-                                   stream=True)
+            request_headers = dict(headers or {})
+            request_headers['Cookie'] = cookie
+            conn = session.request(method, loc.https_url,
+                                   headers=request_headers, stream=True)
             resp = conn.raw
 
             if resp.status >= 400:
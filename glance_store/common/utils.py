@@ -18,7 +18,11 @@
 System-level utilities and helper functions.
 """
 
+import collections
 import logging
+import random
+import threading
+import time
 import uuid
 
 try:
@@ -26,11 +30,19 @@ try:
 except ImportError:
     from time import sleep
 
+import eventlet
+from oslo_utils import encodeutils
+import requests
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
+
+from glance_store import exceptions
 from glance_store.i18n import _
 
 
 LOG = logging.getLogger(__name__)
 
+MAX_RETRY_BACKOFF = 30
+
 
 def is_uuid_like(val):
     """Returns validation of a value as a UUID.
@@ -139,3 +151,276 @@ class CooperativeReader(object):
 
     def __iter__(self):
         return cooperative_iter(self.fd.__iter__())
+
+
+class ExpiringCache(object):
+    """
+    A small thread-safe mapping whose entries expire after a fixed TTL.
+
+    When ``max_size`` is given the cache also behaves as an LRU and evicts
+    the least recently used entry once it is full. A ``ttl`` of zero (or
+    less) disables caching entirely, so callers do not have to special-case
+    the feature being turned off.
+    """
+
+    def __init__(self, ttl, max_size=None, timer=time.time):
+        """
+        :param ttl: lifetime of an entry, in seconds
+        :param max_size: maximum number of entries kept, or None for no limit
+        :param timer: callable returning the current time in seconds
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._timer = timer
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key, default=None):
+        """Return the value cached for `key`, or `default` if missing."""
+        if not self.enabled:
+            return default
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= self._timer():
+                del self._entries[key]
+                return default
+            # Mark the entry as the most recently used one
+            del self._entries[key]
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        """Cache `value` for `key` for the configured TTL."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self._timer() + self.ttl)
+            if self.max_size is not None:
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Drop `key` from the cache, returning its value if present."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_range_header(offset, length):
+    """Return the value of a Range header for a partial read.
+
+    :param offset: Position of the first byte to read
+    :param length: Number of bytes to read, None for all of the rest
+    """
+    if length is None:
+        return 'bytes=%d-' % offset
+    return 'bytes=%d-%d' % (offset, offset + length - 1)
+
+
+def get_retry_backoff(backoff, retries):
+    """Return how long to wait before a retry, in seconds.
+
+    The delay grows exponentially with the number of `retries` already
+    made, up to `MAX_RETRY_BACKOFF`, with full jitter.
+
+    :param backoff: Base delay, in seconds
+    :param retries: Number of retries already made
+    """
+    return random.uniform(0, min(MAX_RETRY_BACKOFF, backoff * 2 ** retries))
+
+
+def check_resumed_response(path, headers, new_headers):
+    """Make sure a resumed read gets the same version of a file.
+
+    The ETag is compared when the server returned one, the Last-Modified
+    time otherwise.
+
+    :param path: path of the file, for the error
+    :param headers: headers of the response the read started with
+    :param new_headers: headers of the response resuming the read
+    :raises: exceptions.BackendException if the file changed
+    """
+    for header in ('etag', 'last-modified'):
+        expected = headers.get(header)
+        if expected:
+            if new_headers.get(header) != expected:
+                reason = (_("%s changed while it was being read.") % path)
+                LOG.error(reason)
+                raise exceptions.BackendException(reason)
+            return
+
+
+def http_response_iterator(conn, response, size, skip=0, length=None):
+    """
+    Return an iterator for a file-like object.
+
+    :param conn: HTTP(S) Connection
+    :param response: urllib3.HTTPResponse object
+    :param size: Chunk size to iterate with
+    :param skip: Number of leading bytes to discard
+    :param length: Maximum number of bytes to return, None for all of them
+    """
+    try:
+        while skip > 0:
+            chunk = response.read(min(size, skip))
+            if not chunk:
+                return
+            skip -= len(chunk)
+
+        while length is None or length > 0:
+            if length is not None:
+                size = min(size, length)
+            chunk = response.read(size)
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+    finally:
+        conn.close()
+
+
+def http_retry_iterator(query, path, conn, size, retry_count, backoff=0,
+                        offset=0, length=0, skip=0):
+    """
+    Return an iterator for an HTTP response, resuming it if it is cut short.
+
+    The rest of the file is requested with a Range header, at most
+    `retry_count` times, after an exponential backoff with full jitter. The
+    file must not have changed since the first response.
+
+    :param query: callable taking the value of a Range header and returning
+                  a requests.Response object for that range
+    :param path: path of the file, for the logs
+    :param conn: requests.Response object to read first
+    :param size: Chunk size to iterate with
+    :param retry_count: Number of times the read is resumed at most
+    :param backoff: Base delay before resuming, in seconds
+    :param offset: Position in the file of the first byte to return
+    :param length: Number of bytes to return, 0 if unknown
+    :param skip: Number of leading bytes of `conn` to discard
+    :raises: exceptions.BackendException if the file changed or could not
+             be read entirely
+    """
+    headers = conn.headers
+    retries = 0
+    bytes_read = 0
+
+    while True:
+        completed = False
+        if conn is not None:
+            remaining = length - bytes_read if length else None
+            try:
+                for chunk in http_response_iterator(conn, conn.raw, size,
+                                                    skip=skip,
+                                                    length=remaining):
+                    yield chunk
+                    bytes_read += len(chunk)
+                completed = not length
+            except (IOError, urllib3_exceptions.HTTPError) as e:
+                LOG.warning(_("Error reading %(path)s: %(error)s") %
+                            {'path': path,
+                             'error': encodeutils.exception_to_unicode(e)})
+
+        if completed or (length and bytes_read == length):
+            break
+
+        if retries >= retry_count:
+            reason = (_("Stopping retries after %(retries)d attempts with "
+                        "%(bytes_read)d bytes of %(path)s read.") %
+                      {'retries': retries, 'bytes_read': bytes_read,
+                       'path': path})
+            LOG.error(reason)
+            raise exceptions.BackendException(reason)
+
+        sleep(get_retry_backoff(backoff, retries))
+        retries += 1
+        start = offset + bytes_read
+        remaining = length - bytes_read if length else None
+        range_header = get_range_header(start, remaining)
+        LOG.info(_("Retrying read of %(path)s (%(retries)d/%(max_retries)d) "
+                   "with range %(range)s") %
+                 {'path': path, 'retries': retries,
+                  'max_retries': retry_count, 'range': range_header})
+        try:
+            conn = query(range_header)
+        except (exceptions.BadStoreUri,
+                requests.exceptions.RequestException) as e:
+            # NOTE: BadStoreUri covers the 5xx and 429 responses of a
+            # server that is overloaded or restarting.
+            LOG.warning(_("Error reading %(path)s: %(error)s") %
+                        {'path': path,
+                         'error': encodeutils.exception_to_unicode(e)})
+            conn = None
+            continue
+
+        check_resumed_response(path, headers, conn.headers)
+        if conn.status_code == requests.codes.partial_content:
+            skip = 0
+        else:
+            skip = start
+
+
+def iter_ranges(fetch, start, end, range_size, concurrency, chunk_size,
+                first=None):
+    """
+    Yield the bytes of a file from `start` to `end`, not included.
+
+    Ranges of `range_size` bytes are fetched by greenthreads, buffered in
+    memory and yielded in order; at most `concurrency` ranges are fetched
+    ahead of the one being yielded. The greenthreads still running are
+    killed when the iterator is closed.
+
+    :param fetch: callable taking the start and the length of a range and
+                  returning its bytes
+    :param start: Position of the first range
+    :param end: Position after the last byte
+    :param range_size: Size of the ranges
+    :param concurrency: Number of ranges fetched at once at most
+    :param chunk_size: Size of the chunks a range is yielded as
+    :param first: iterator over the bytes before `start`, yielded while
+                  the first ranges are fetched
+    """
+    def _ranges():
+        range_start = start
+        while range_start < end:
+            length = min(range_size, end - range_start)
+            yield range_start, length
+            range_start += length
+
+    ranges = _ranges()
+    pending = collections.deque()
+
+    def _fill():
+        for range_start, length in ranges:
+            pending.append(eventlet.spawn(fetch, range_start, length))
+            if len(pending) >= concurrency:
+                break
+
+    try:
+        _fill()
+        for chunk in first or ():
+            yield chunk
+        while pending:
+            data = pending.popleft().wait()
+            _fill()
+            for i in range(0, len(data), chunk_size):
+                yield data[i:i + chunk_size]
+    finally:
+        for thread in pending:
+            thread.kill()
@@ -239,7 +239,7 @@ class TestCinderStore(base.StoreBaseTest,
     def test_cinder_get_size(self):
         fake_client = FakeObject(auth_token=None, management_url=None)
         fake_volume_uuid = str(uuid.uuid4())
-        fake_volume = FakeObject(size=5)
+        fake_volume = FakeObject(size=5, metadata={})
         fake_volumes = {fake_volume_uuid: fake_volume}
 
         with mock.patch.object(cinder, 'get_cinderclient') as mocked_cc:
@@ -251,6 +251,23 @@ class TestCinderStore(base.StoreBaseTest,
             image_size = self.store.get_size(loc, context=self.context)
             self.assertEqual(image_size, fake_volume.size * units.Gi)
 
+    def test_cinder_get_size_with_metadata(self):
+        fake_client = FakeObject(auth_token=None, management_url=None)
+        fake_volume_uuid = str(uuid.uuid4())
+        expected_image_size = 4500 * units.Mi
+        fake_volume = FakeObject(size=5,
+                                 metadata={'image_size': expected_image_size})
+        fake_volumes = {fake_volume_uuid: fake_volume}
+
+        with mock.patch.object(cinder, 'get_cinderclient') as mocked_cc:
+            mocked_cc.return_value = FakeObject(client=fake_client,
+                                                volumes=fake_volumes)
+
+            uri = 'cinder://%s' % fake_volume_uuid
+            loc = location.get_location_from_uri(uri, conf=self.conf)
+            image_size = self.store.get_size(loc, context=self.context)
+            self.assertEqual(expected_image_size, image_size)
+
     def _test_cinder_add(self, fake_volume, volume_file, size_kb=5,
                          verifier=None):
         expected_image_id = str(uuid.uuid4())
@@ -310,6 +327,49 @@ class TestCinderStore(base.StoreBaseTest,
                               self._test_cinder_add, fake_volume, volume_file)
         fake_volume.delete.assert_called_once_with()
 
+    def _test_cinder_add_unknown_size(self, size_kb):
+        """Add an image of unknown size, with 1 KB standing in for 1 GB."""
+        self.store.WRITE_CHUNKSIZE = units.Ki
+        fake_volume = mock.MagicMock(id=str(uuid.uuid4()), status='available')
+        fake_volume.manager.get.return_value = fake_volume
+        fake_volumes = FakeObject(create=mock.Mock(return_value=fake_volume))
+        volume_file = six.BytesIO()
+        image_file = six.BytesIO(b"*" * size_kb * units.Ki)
+
+        @contextlib.contextmanager
+        def fake_open(client, volume, mode):
+            yield volume_file
+
+        with mock.patch.object(cinder, 'get_cinderclient') as mock_cc, \
+                mock.patch.object(self.store, '_open_cinder_volume',
+                                  side_effect=fake_open), \
+                mock.patch.object(cinder.units, 'Gi', units.Ki):
+            mock_cc.return_value = FakeObject(client=mock.Mock(),
+                                              volumes=fake_volumes)
+            loc, size, checksum, _ = self.store.add(str(uuid.uuid4()),
+                                                    image_file, 0,
+                                                    self.context)
+
+        self.assertEqual(size_kb * units.Ki, size)
+        self.assertEqual(image_file.getvalue(), volume_file.getvalue())
+        fake_volume.update_all_metadata.assert_called_once_with(
+            mock.ANY)
+        metadata = fake_volume.update_all_metadata.call_args[0][0]
+        self.assertEqual(str(size), metadata['image_size'])
+        return [c[0][1] for c in fake_volume.extend.call_args_list]
+
+    def test_cinder_add_unknown_size(self):
+        self.assertEqual([2, 4, 8], self._test_cinder_add_unknown_size(5))
+
+    def test_cinder_add_unknown_size_max_growth(self):
+        self.config(cinder_volume_max_growth=3)
+        self.assertEqual([2, 4, 7, 10, 13],
+                         self._test_cinder_add_unknown_size(11))
+
+    def test_cinder_add_unknown_size_no_growth(self):
+        self.config(cinder_volume_growth_factor=1)
+        self.assertEqual([2, 3, 4, 5], self._test_cinder_add_unknown_size(5))
+
     def test_cinder_delete(self):
         fake_client = FakeObject(auth_token=None, management_url=None)
         fake_volume_uuid = str(uuid.uuid4())
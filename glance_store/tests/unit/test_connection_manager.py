@@ -110,7 +110,7 @@ class TestConnectionManager(base.StoreBaseTest):
         store._get_endpoint.assert_called_once_with(self.context)
         # return the same connection because it should not be expired
         auth_ref = mock.MagicMock()
-        self.client.session.auth.get_auth_ref.return_value = auth_ref
+        self.client.session.auth.get_access.return_value = auth_ref
         auth_ref.will_expire_soon.return_value = False
         manager.get_connection()
         # check that we don't update connection
@@ -131,7 +131,7 @@ class TestConnectionManager(base.StoreBaseTest):
         store._get_endpoint.assert_called_once_with(self.context)
         # return the same connection because it should not be expired
         auth_ref = mock.MagicMock()
-        self.client.session.auth.get_auth_ref.return_value = auth_ref
+        self.client.session.auth.get_access.return_value = auth_ref
         auth_ref.will_expire_soon.return_value = True
         manager.get_connection()
         # check that we don't update connection
@@ -153,7 +153,7 @@ class TestConnectionManager(base.StoreBaseTest):
         )
         # return the same connection because it should not be expired
         auth_ref = mock.MagicMock()
-        self.client.session.auth.get_auth_ref.return_value = auth_ref
+        self.client.session.auth.get_access.return_value = auth_ref
         auth_ref.will_expire_soon.return_value = False
         manager.get_connection()
         # check that we don't update connection
@@ -176,9 +176,66 @@ class TestConnectionManager(base.StoreBaseTest):
         )
         # return the same connection because it should not be expired
         auth_ref = mock.MagicMock()
-        self.client.session.auth.get_auth_ref.return_value = auth_ref
+        self.client.session.auth.get_access.return_value = auth_ref
         auth_ref.will_expire_soon.return_value = True
         manager.get_connection()
         # check that we don't update connection
         self.assertEqual(2, store.get_store_connection.call_count)
         self.assertEqual(2, self.client.session.get_auth_headers.call_count)
+        # the cached token is dropped so that a new one is requested
+        self.client.session.auth.invalidate.assert_called_with()
+
+    def test_single_tenant_cm_init_with_fresh_token(self):
+        store = self.prepare_store()
+        auth_ref = mock.MagicMock()
+        auth_ref.will_expire_soon.return_value = False
+        self.client.session.auth.get_access.return_value = auth_ref
+        connection_manager.SingleTenantConnectionManager(
+            store=store,
+            store_location=self.location
+        )
+        # the token held by a shared client is reused
+        self.assertFalse(self.client.session.auth.invalidate.called)
+        self.client.session.get_auth_headers.assert_called_once_with()
+
+    def test_single_tenant_cm_exit_caches_auth(self):
+        store = self.prepare_store()
+        store.auth_version = '2'
+        with connection_manager.SingleTenantConnectionManager(
+                store=store, store_location=self.location) as manager:
+            pass
+        store._cache_auth.assert_called_once_with(self.location,
+                                                  manager.connection)
+
+    def test_worker_cm_follows_parent_token(self):
+        store = self.prepare_store()
+        parent = mock.MagicMock()
+        parent.get_connection.return_value = mock.MagicMock(
+            url="https://swift/v1/AUTH_a", token="token1")
+        manager = connection_manager.WorkerConnectionManager(
+            parent, store, self.location, self.context)
+        connection = manager.get_connection()
+        store.get_store_connection.return_value.token = "token1"
+        self.assertEqual(connection, manager.get_connection())
+        store.get_store_connection.assert_called_once_with(
+            "token1", "https://swift/v1/AUTH_a")
+
+        # the parent refreshed its token
+        parent.get_connection.return_value.token = "token2"
+        manager.get_connection()
+        store.get_store_connection.assert_called_with(
+            "token2", "https://swift/v1/AUTH_a")
+        self.assertEqual(2, store.get_store_connection.call_count)
+
+    def test_worker_cm_unauthenticated_parent(self):
+        store = self.prepare_store()
+        parent = mock.MagicMock()
+        parent.get_connection.return_value = mock.MagicMock(url=None,
+                                                            token=None)
+        manager = connection_manager.WorkerConnectionManager(
+            parent, store, self.location, self.context)
+        connection = manager.get_connection()
+        self.assertEqual(connection, manager.get_connection())
+        store.get_connection.assert_called_once_with(self.location,
+                                                     context=self.context)
+        self.assertFalse(store.get_store_connection.called)
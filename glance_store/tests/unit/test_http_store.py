@@ -13,12 +13,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import mock
+import time
 
+import mock
+from oslo_utils import units
 import requests
+import six
 
 import glance_store
 from glance_store._drivers import http
+from glance_store.common import utils as common_utils
 from glance_store import exceptions
 from glance_store import location
 from glance_store.tests import base
@@ -34,6 +38,7 @@ class TestHttpStore(base.StoreBaseTest,
         self.config(default_store='http', group='glance_store')
         http.Store.READ_CHUNKSIZE = 2
         self.store = http.Store(self.conf)
+        self.store.configure()
         self.register_store_schemes(self.store, 'http')
 
     def _mock_requests(self):
@@ -59,10 +64,348 @@ class TestHttpStore(base.StoreBaseTest,
         self.assertEqual(expected_returns, chunks)
 
     def test_http_partial_get(self):
+        self._mock_requests()
+        self.request.return_value = utils.fake_response(
+            status_code=206,
+            headers={'content-length': 5,
+                     'content-range': 'bytes 2-6/31'},
+            content='am a ')
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc, offset=2,
+                                                  chunk_size=5)
+        self.assertEqual(5, image_size)
+        self.assertEqual(['am', ' a', ' '], [c for c in image_file])
+        self.request.assert_called_once_with(
+            'GET', uri, stream=True, allow_redirects=False,
+            headers={'Range': 'bytes=2-6'})
+
+    def test_http_partial_get_offset_only(self):
+        self._mock_requests()
+        self.request.return_value = utils.fake_response(
+            status_code=206,
+            headers={'content-length': 3,
+                     'content-range': 'bytes 28-30/31'},
+            content='ut\n')
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc, offset=28)
+        self.assertEqual(3, image_size)
+        self.assertEqual(['ut', '\n'], [c for c in image_file])
+        self.request.assert_called_once_with(
+            'GET', uri, stream=True, allow_redirects=False,
+            headers={'Range': 'bytes=28-'})
+
+    def test_http_partial_get_range_ignored(self):
+        # A server without range support answers with the whole image.
+        self._mock_requests()
+        self.request.side_effect = [utils.fake_response(),
+                                    utils.fake_response()]
+
         uri = "http://netloc/path/to/file.tar.gz"
         loc = location.get_location_from_uri(uri, conf=self.conf)
-        self.assertRaises(exceptions.StoreRandomGetNotSupported,
-                          self.store.get, loc, chunk_size=1)
+        (image_file, image_size) = self.store.get(loc, offset=2,
+                                                  chunk_size=5)
+        self.assertEqual(5, image_size)
+        self.assertEqual(['am', ' a', ' '], [c for c in image_file])
+
+        (image_file, image_size) = self.store.get(loc, offset=28,
+                                                  chunk_size=10)
+        self.assertEqual(3, image_size)
+        self.assertEqual(['ut', '\n'], [c for c in image_file])
+
+    def test_http_partial_get_redirect(self):
+        self._mock_requests()
+        redirect = {"location": "http://example.com/teapot.img"}
+        self.request.side_effect = [
+            utils.fake_response(status_code=302, headers=redirect),
+            utils.fake_response(status_code=206,
+                                headers={'content-length': 2},
+                                content='am')]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc, offset=2,
+                                                  chunk_size=2)
+        self.assertEqual(2, image_size)
+        self.assertEqual(['am'], [c for c in image_file])
+        self.request.assert_called_with(
+            'GET', redirect['location'], stream=True,
+            allow_redirects=False, headers={'Range': 'bytes=2-3'})
+
+    def _broken_response(self, chunks, headers=None):
+        """Return a response whose body is cut short by a reset."""
+        response = utils.fake_response(headers=headers)
+        response.raw.read = mock.Mock(
+            side_effect=chunks + [IOError('Connection reset by peer')])
+        return response
+
+    def test_http_get_resumed(self):
+        self.config(http_retry_get_count=1, http_retry_get_backoff=0,
+                    group='glance_store')
+        self._mock_requests()
+        self.request.side_effect = [
+            self._broken_response(['I ', 'am'],
+                                  headers={'etag': '"teapot"',
+                                           'content-length': 31}),
+            utils.fake_response(status_code=206,
+                                headers={'etag': '"teapot"',
+                                         'content-length': 27},
+                                content=' a teapot, short and stout\n')]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual(31, image_size)
+        self.assertEqual('I am a teapot, short and stout\n',
+                         ''.join(image_file))
+        self.request.assert_called_with(
+            'GET', uri, stream=True, allow_redirects=False,
+            headers={'Range': 'bytes=4-30'})
+
+    def test_http_get_resumed_range_ignored(self):
+        self.config(http_retry_get_count=1, http_retry_get_backoff=0,
+                    group='glance_store')
+        self._mock_requests()
+        self.request.side_effect = [self._broken_response(['I ', 'am']),
+                                    utils.fake_response()]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual('I am a teapot, short and stout\n',
+                         ''.join(image_file))
+
+    def test_http_get_resumed_image_changed(self):
+        self.config(http_retry_get_count=1, http_retry_get_backoff=0,
+                    group='glance_store')
+        self._mock_requests()
+        self.request.side_effect = [
+            self._broken_response(['I ', 'am'],
+                                  headers={'etag': '"teapot"',
+                                           'content-length': 31}),
+            utils.fake_response(status_code=206,
+                                headers={'etag': '"kettle"',
+                                         'content-length': 27})]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertRaises(exceptions.BackendException, list, image_file)
+
+    def _error_response(self, status_code):
+        return mock.Mock(status_code=status_code, text='Server error')
+
+    def test_http_get_resumed_after_server_errors(self):
+        self.config(http_retry_get_count=3, http_retry_get_backoff=0,
+                    group='glance_store')
+        self._mock_requests()
+        self.request.side_effect = [
+            self._broken_response(['I ', 'am'],
+                                  headers={'etag': '"teapot"',
+                                           'content-length': 31}),
+            self._error_response(503),
+            self._error_response(429),
+            utils.fake_response(status_code=206,
+                                headers={'etag': '"teapot"',
+                                         'content-length': 27},
+                                content=' a teapot, short and stout\n')]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual('I am a teapot, short and stout\n',
+                         ''.join(image_file))
+        self.assertEqual(4, self.request.call_count)
+
+    def test_http_get_server_errors_exhaust_retries(self):
+        self.config(http_retry_get_count=2, http_retry_get_backoff=0,
+                    group='glance_store')
+        self._mock_requests()
+        self.request.side_effect = [
+            self._broken_response(['I ']),
+            self._error_response(500),
+            self._error_response(502)]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertRaises(exceptions.BackendException, list, image_file)
+        self.assertEqual(3, self.request.call_count)
+
+    def test_http_get_retries_exhausted(self):
+        self.config(http_retry_get_count=2, http_retry_get_backoff=0,
+                    group='glance_store')
+        self._mock_requests()
+        self.request.side_effect = [self._broken_response(['I ']),
+                                    requests.exceptions.ConnectionError(),
+                                    self._broken_response([])]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertRaises(exceptions.BackendException, list, image_file)
+        self.assertEqual(3, self.request.call_count)
+
+    @mock.patch.object(common_utils, 'sleep')
+    @mock.patch.object(common_utils.random, 'uniform')
+    def test_http_get_retry_backoff(self, mock_uniform, mock_sleep):
+        self.config(http_retry_get_count=2, group='glance_store')
+        mock_uniform.side_effect = lambda low, high: high
+        self._mock_requests()
+        self.request.side_effect = [self._broken_response([]),
+                                    self._broken_response([]),
+                                    utils.fake_response()]
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual('I am a teapot, short and stout\n',
+                         ''.join(image_file))
+        self.assertEqual([mock.call(0.5), mock.call(1.0)],
+                         mock_sleep.call_args_list)
+
+    def _mock_ranged_server(self, data, headers=None):
+        """Serve `data` from a mocked server which accepts ranges."""
+        self._mock_requests()
+
+        def fake_request(verb, uri, **kwargs):
+            response_headers = {'accept-ranges': 'bytes',
+                                'etag': '"teapot"'}
+            response_headers.update(headers or {})
+            range_header = kwargs.get('headers', {}).get('Range')
+            status_code = 200
+            body = data
+            if verb == 'GET' and range_header:
+                status_code = 206
+                start, end = range_header[len('bytes='):].split('-')
+                body = data[int(start):int(end) + 1]
+            response_headers['content-length'] = len(body)
+            response = utils.fake_response(status_code=status_code,
+                                           headers=response_headers)
+            response.raw.read = six.BytesIO(body).read
+            return response
+
+        self.request.side_effect = fake_request
+        self.store.READ_CHUNKSIZE = 64 * units.Ki
+
+    def _get_ranges(self):
+        return [c[1]['headers']['Range']
+                for c in self.request.call_args_list if 'headers' in c[1]]
+
+    def test_http_get_ranged(self):
+        self.config(http_download_concurrency=2, http_download_range_size=1,
+                    group='glance_store')
+        data = b''.join(six.int2byte(i % 256)
+                        for i in range(int(2.5 * units.Mi)))
+        self._mock_ranged_server(data)
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual(len(data), image_size)
+        self.assertEqual(data, b''.join(image_file))
+        self.assertEqual('HEAD', self.request.call_args_list[0][0][0])
+        self.assertEqual(['bytes=0-1048575', 'bytes=1048576-2097151',
+                          'bytes=2097152-2621439'], self._get_ranges())
+
+    def test_http_get_ranged_partial(self):
+        self.config(http_download_concurrency=3, http_download_range_size=1,
+                    group='glance_store')
+        data = b'x' * units.Mi + b'y' * units.Mi + b'z' * units.Mi
+        self._mock_ranged_server(data)
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        offset = units.Mi - 10
+        (image_file, image_size) = self.store.get(
+            loc, offset=offset, chunk_size=units.Mi + 20)
+        self.assertEqual(units.Mi + 20, image_size)
+        self.assertEqual(data[offset:offset + units.Mi + 20],
+                         b''.join(image_file))
+        self.assertEqual(['bytes=1048566-2097141', 'bytes=2097142-2097161'],
+                         self._get_ranges())
+
+    def test_http_get_ranged_not_accepted(self):
+        self.config(http_download_concurrency=2, http_download_range_size=1,
+                    group='glance_store')
+        data = b'x' * 2 * units.Mi
+        self._mock_ranged_server(data, headers={'accept-ranges': 'none'})
+
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual(data, b''.join(image_file))
+        self.assertEqual(2, self.request.call_count)
+        self.assertEqual([], self._get_ranges())
+
+    def test_http_get_ranged_image_changed(self):
+        self.config(http_download_concurrency=2, http_download_range_size=1,
+                    group='glance_store')
+        self._mock_ranged_server(b'x' * 2 * units.Mi)
+        fake_request = self.request.side_effect
+
+        def changed_request(verb, uri, **kwargs):
+            response = fake_request(verb, uri, **kwargs)
+            if verb == 'GET':
+                response.headers['etag'] = '"kettle"'
+            return response
+
+        self.request.side_effect = changed_request
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        (image_file, image_size) = self.store.get(loc)
+        self.assertRaises(exceptions.BackendException, list, image_file)
+
+    def test_http_session_per_host(self):
+        self._mock_requests()
+        self.request.side_effect = lambda *args, **kwargs: (
+            utils.fake_response())
+
+        for uri in ("http://netloc/path/to/file.tar.gz",
+                    "http://netloc/path/to/other.tar.gz",
+                    "https://netloc/path/to/file.tar.gz",
+                    "http://mirror/path/to/file.tar.gz"):
+            loc = location.get_location_from_uri(uri, conf=self.conf)
+            self.store.get(loc)
+        self.assertEqual(3, len(self.store.sessions))
+        self.assertEqual(1, self.store.sessions.hits)
+        self.assertEqual(3, self.store.sessions.misses)
+
+    def test_http_session_settings(self):
+        self.config(https_ca_certificates_file='/etc/ssl/ca.pem',
+                    http_proxy_information={'https': '10.0.0.1:1080'},
+                    http_pool_size=20, http_keep_alive=False,
+                    group='glance_store')
+        uri = "https://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        session = self.store._get_session(loc.store_location)
+        self.assertEqual('/etc/ssl/ca.pem', session.verify)
+        self.assertEqual({'https': '10.0.0.1:1080'}, session.proxies)
+        self.assertEqual('close', session.headers['Connection'])
+        self.assertEqual(20, session.get_adapter(uri)._pool_maxsize)
+        self.assertIs(session, self.store._get_session(loc.store_location))
+
+        # Changing the settings gives a new session
+        self.config(https_insecure=False, https_ca_certificates_file=None,
+                    group='glance_store')
+        new_session = self.store._get_session(loc.store_location)
+        self.assertIsNot(session, new_session)
+        self.assertTrue(new_session.verify)
+
+    def test_session_pool_evicts_least_recently_used(self):
+        pool = http.SessionPool(max_sessions=2)
+        sessions = dict((host, mock.Mock()) for host in 'abc')
+        for host in 'abac':
+            pool.get(('http', host, True, None), lambda: sessions[host])
+        self.assertEqual(2, len(pool))
+        sessions['b'].close.assert_called_once_with()
+        self.assertFalse(sessions['a'].close.called)
+        pool.clear()
+        sessions['a'].close.assert_called_once_with()
+        sessions['c'].close.assert_called_once_with()
 
     def test_http_get_redirect(self):
         # Add two layers of redirects to the response stack, which will
@@ -163,6 +506,119 @@ class TestHttpStore(base.StoreBaseTest,
         loc = location.get_location_from_uri(uri, conf=self.conf)
         self.assertRaises(exceptions.BadStoreUri, self.store.get_size, loc)
 
+    def _mock_redirected_server(self):
+        """Redirect netloc to example.com, which serves the image."""
+        self._mock_requests()
+        redirect = {'location': 'http://example.com/teapot.img'}
+        validators = {'etag': '"teapot"', 'content-length': 31}
+
+        def fake_request(verb, uri, **kwargs):
+            if uri != redirect['location']:
+                return utils.fake_response(status_code=302, headers=redirect)
+            headers = kwargs.get('headers', {})
+            if headers.get('If-None-Match') == validators['etag']:
+                return utils.fake_response(status_code=304, headers={})
+            return utils.fake_response(headers=dict(validators))
+
+        self.request.side_effect = fake_request
+        return redirect['location']
+
+    def test_http_get_size_cached(self):
+        self._mock_redirected_server()
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        self.assertEqual(31, self.store.get_size(loc))
+        self.assertEqual(2, self.request.call_count)
+
+        self.request.reset_mock()
+        self.assertEqual(31, self.store.get_size(loc))
+        self.assertFalse(self.request.called)
+
+    def test_http_get_size_revalidated(self):
+        resolved = self._mock_redirected_server()
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        self.assertEqual(31, self.store.get_size(loc))
+
+        self.request.reset_mock()
+        later = time.time() + 301
+        with mock.patch.object(http.time, 'time', return_value=later):
+            self.assertEqual(31, self.store.get_size(loc))
+            self.request.assert_called_once_with(
+                'HEAD', resolved, stream=True, allow_redirects=False,
+                headers={'If-None-Match': '"teapot"'})
+
+            # The revalidated size is fresh again
+            self.request.reset_mock()
+            self.assertEqual(31, self.store.get_size(loc))
+            self.assertFalse(self.request.called)
+
+    def test_http_get_uses_resolved_url(self):
+        resolved = self._mock_redirected_server()
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        self.store.get_size(loc)
+
+        self.request.reset_mock()
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual('I am a teapot, short and stout\n',
+                         ''.join(image_file))
+        self.request.assert_called_once_with(
+            'GET', resolved, stream=True, allow_redirects=False)
+
+    def test_http_resolved_url_gone(self):
+        self._mock_redirected_server()
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        self.store.get_size(loc)
+
+        # The image moved, so the location redirects somewhere else
+        self.request.reset_mock()
+        self.request.side_effect = [
+            utils.fake_response(status_code=404),
+            utils.fake_response(
+                status_code=302,
+                headers={'location': 'http://example.com/kettle.img'}),
+            utils.fake_response()]
+        (image_file, image_size) = self.store.get(loc)
+        self.assertEqual(31, image_size)
+        self.assertEqual(3, self.request.call_count)
+        self.assertEqual('http://example.com/kettle.img',
+                         self.request.call_args[0][1])
+
+    def test_http_resolved_url_expires(self):
+        resolved = self._mock_redirected_server()
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        with mock.patch.object(self.store._redirects, '_timer',
+                               return_value=1000):
+            self.store.get_size(loc)
+
+        # Using the resolved URL does not extend its lifetime
+        self.request.reset_mock()
+        self.request.side_effect = None
+        self.request.return_value = utils.fake_response()
+        with mock.patch.object(self.store._redirects, '_timer',
+                               return_value=1200):
+            self.store.get(loc)
+        self.assertEqual(resolved, self.request.call_args[0][1])
+
+        self.request.reset_mock()
+        with mock.patch.object(self.store._redirects, '_timer',
+                               return_value=1301):
+            self.store.get(loc)
+        self.assertEqual(uri, self.request.call_args[0][1])
+
+    def test_http_url_cache_disabled(self):
+        self.config(http_url_cache_ttl=0, group='glance_store')
+        self.store.configure()
+        self._mock_redirected_server()
+        uri = "http://netloc/path/to/file.tar.gz"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        self.assertEqual(31, self.store.get_size(loc))
+        self.assertEqual(31, self.store.get_size(loc))
+        self.assertEqual(4, self.request.call_count)
+
     def test_http_store_location_initialization(self):
         """Test store location initialization from valid uris"""
         uris = [
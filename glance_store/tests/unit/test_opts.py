@@ -66,6 +66,8 @@ class OptsTestCase(base.StoreBaseTest):
             'cinder_http_retries',
             'cinder_os_region_name',
             'cinder_state_transition_timeout',
+            'cinder_volume_growth_factor',
+            'cinder_volume_max_growth',
             'cinder_store_auth_address',
             'cinder_store_user_name',
             'cinder_store_password',
@@ -77,12 +79,29 @@ class OptsTestCase(base.StoreBaseTest):
             'filesystem_store_file_perm',
             'filesystem_store_metadata_file',
             'http_proxy_information',
+            'http_retry_get_count',
+            'http_retry_get_backoff',
+            'http_download_concurrency',
+            'http_download_range_size',
+            'http_pool_size',
+            'http_keep_alive',
+            'http_url_cache_ttl',
             'https_ca_certificates_file',
             'rbd_store_ceph_conf',
             'rbd_store_chunk_size',
+            'rbd_store_deferred_delete',
             'rbd_store_pool',
+            'rbd_store_read_window',
+            'rbd_store_resize_growth_factor',
+            'rbd_store_resize_max_step',
+            'rbd_store_sparse_read',
+            'rbd_store_trash_purge_interval',
             'rbd_store_user',
+            'rbd_store_write_window',
+            'rbd_thin_provisioning',
             'rados_connect_timeout',
+            'rados_connection_pool_size',
+            'rados_connection_idle_timeout',
             'rootwrap_config',
             's3_store_access_key',
             's3_store_bucket',
@@ -95,6 +114,7 @@ class OptsTestCase(base.StoreBaseTest):
             's3_store_large_object_chunk_size',
             's3_store_thread_pools',
             's3_store_enable_proxy',
+            's3_store_head_cache_ttl',
             'swift_store_expire_soon_interval',
             's3_store_proxy_host',
             's3_store_proxy_port',
@@ -120,12 +140,25 @@ class OptsTestCase(base.StoreBaseTest):
             'swift_store_multiple_containers_seed',
             'swift_store_region',
             'swift_store_retry_get_count',
+            'swift_store_retry_get_backoff',
+            'swift_store_retry_get_deadline',
             'swift_store_service_type',
             'swift_store_ssl_compression',
             'swift_store_use_trusts',
+            'swift_store_upload_concurrency',
+            'swift_store_use_slo',
+            'swift_store_delete_concurrency',
+            'swift_store_download_concurrency',
+            'swift_store_download_range_size',
+            'swift_store_auth_cache_ttl',
+            'swift_store_container_cache_ttl',
+            'swift_store_upload_session_ttl',
             'swift_store_user',
             'vmware_insecure',
             'vmware_ca_file',
+            'vmware_upload_chunk_size',
+            'vmware_session_check_interval',
+            'vmware_freespace_cache_ttl',
             'vmware_api_retry_count',
             'vmware_datastores',
             'vmware_server_host',
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+
 import mock
 from oslo_utils import units
 import six
@@ -127,6 +129,9 @@ class MockRBD(object):
         def size(self):
             raise NotImplementedError()
 
+        def features(self):
+            raise NotImplementedError()
+
     class RBD(object):
 
         def __init__(self, *args, **kwargs):
@@ -151,6 +156,7 @@ class MockRBD(object):
             raise NotImplementedError()
 
     RBD_FEATURE_LAYERING = 1
+    RBD_FEATURE_FAST_DIFF = 16
 
 
 class TestStore(base.StoreBaseTest,
@@ -162,6 +168,7 @@ class TestStore(base.StoreBaseTest,
 
         rbd_store.rados = MockRados
         rbd_store.rbd = MockRBD
+        self.addCleanup(rbd_store.CONNECTION_POOL.clear)
 
         self.store = rbd_store.Store(self.conf)
         self.store.configure()
@@ -188,6 +195,40 @@ class TestStore(base.StoreBaseTest,
                 self.assertTrue(write.called)
                 self.assertEqual(ret[1], self.data_len)
 
+    def _add_unknown_size(self):
+        """Add 5K and 10 bytes of unknown size, returning the resizes."""
+        self.store.WRITE_CHUNKSIZE = units.Ki
+        data = b'*' * (5 * units.Ki + 10)
+        with mock.patch.object(rbd_store.rbd.Image, 'resize') as resize:
+            with mock.patch.object(rbd_store.rbd.Image, 'write') as write:
+                write.side_effect = lambda data, offset: len(data)
+                ret = self.store.add('fake_image_id', six.BytesIO(data), 0)
+
+        self.assertEqual(len(data), ret[1])
+        return [c[0][0] for c in resize.call_args_list]
+
+    def test_add_w_image_size_zero_grows_geometrically(self):
+        self.config(rbd_store_write_window=1)
+        self.store.configure()
+        self.assertEqual([units.Ki, 2 * units.Ki, 4 * units.Ki, 8 * units.Ki,
+                          5 * units.Ki + 10], self._add_unknown_size())
+
+    def test_add_w_image_size_zero_max_step(self):
+        self.config(rbd_store_write_window=1)
+        self.store.configure()
+        self.store.resize_max_step = units.Ki + 512
+        self.assertEqual([units.Ki, 2 * units.Ki, 7 * units.Ki // 2,
+                          5 * units.Ki, 13 * units.Ki // 2, 5 * units.Ki + 10],
+                         self._add_unknown_size())
+
+    def test_add_w_image_size_zero_no_growth(self):
+        self.config(rbd_store_write_window=1,
+                    rbd_store_resize_growth_factor=1)
+        self.store.configure()
+        self.assertEqual([units.Ki, 2 * units.Ki, 3 * units.Ki, 4 * units.Ki,
+                          5 * units.Ki, 5 * units.Ki + 10],
+                         self._add_unknown_size())
+
     @mock.patch.object(MockRBD.Image, '__enter__')
     @mock.patch.object(rbd_store.Store, '_create_image')
     @mock.patch.object(rbd_store.Store, '_delete_image')
@@ -214,6 +255,107 @@ class TestStore(base.StoreBaseTest,
 
         self.called_commands_expected = ['create', 'delete']
 
+    def _fake_aio_write(self, fail_offset=None):
+        """Return a fake aio_write recording the calls made to it."""
+        self.aio_calls = []
+
+        def _aio_write(data, offset, oncomplete):
+            self.aio_calls.append(('write', offset))
+            completion = mock.Mock()
+            ret = -5 if offset == fail_offset else 0
+            completion.get_return_value.return_value = ret
+
+            def _wait():
+                self.aio_calls.append(('wait', offset))
+                oncomplete(completion)
+
+            completion.wait_for_complete_and_cb.side_effect = _wait
+            return completion
+        return _aio_write
+
+    def test_add_pipelined_writes(self):
+        self.config(rbd_store_write_window=2)
+        self.store.configure()
+        self.store.chunk_size = units.Ki
+        self.store.WRITE_CHUNKSIZE = units.Ki
+        with mock.patch.object(rbd_store.rbd.Image, 'aio_write',
+                               create=True) as aio_write:
+            aio_write.side_effect = self._fake_aio_write()
+            with mock.patch.object(rbd_store.rbd.Image, 'write') as write:
+                ret = self.store.add('fake_image_id', self.data_iter,
+                                     self.data_len)
+
+        self.assertFalse(write.called)
+        # No more than two writes are ever in flight
+        self.assertEqual([('write', 0), ('write', units.Ki), ('wait', 0),
+                          ('write', 2 * units.Ki), ('wait', units.Ki),
+                          ('wait', 2 * units.Ki)], self.aio_calls)
+        self.assertEqual(self.data_len, ret[1])
+        expected_checksum = hashlib.md5(b'*' * self.data_len).hexdigest()
+        self.assertEqual(expected_checksum, ret[2])
+
+    @mock.patch.object(rbd_store.Store, '_delete_image')
+    def test_add_pipelined_write_error(self, delete):
+        self.config(rbd_store_write_window=2)
+        self.store.configure()
+        self.store.chunk_size = units.Ki
+        self.store.WRITE_CHUNKSIZE = units.Ki
+        with mock.patch.object(rbd_store.rbd.Image, 'aio_write',
+                               create=True) as aio_write:
+            aio_write.side_effect = self._fake_aio_write(fail_offset=0)
+            self.assertRaises(exceptions.BackendException, self.store.add,
+                              'fake_image_id', self.data_iter, self.data_len)
+
+        # The failure is noticed before the third chunk is written, and the
+        # pending write is waited for before the image is deleted.
+        self.assertEqual([('write', 0), ('write', units.Ki), ('wait', 0),
+                          ('wait', units.Ki)], self.aio_calls)
+        self.assertTrue(delete.called)
+
+    def test_add_write_window_disabled(self):
+        self.config(rbd_store_write_window=1)
+        self.store.configure()
+        self.store.chunk_size = units.Ki
+        with mock.patch.object(rbd_store.rbd.Image, 'aio_write',
+                               create=True) as aio_write:
+            with mock.patch.object(rbd_store.rbd.Image, 'write') as write:
+                write.side_effect = lambda data, offset: len(data)
+                self.store.add('fake_image_id', self.data_iter,
+                               self.data_len)
+
+        self.assertFalse(aio_write.called)
+        self.assertTrue(write.called)
+
+    def test_add_skips_zero_chunks(self):
+        self.config(rbd_store_write_window=1)
+        self.store.configure()
+        self.store.chunk_size = units.Ki
+        self.store.WRITE_CHUNKSIZE = units.Ki
+        data = b'*' * units.Ki + b'\0' * units.Ki + b'*' * 10
+        verifier = mock.MagicMock(name='mock_verifier')
+        with mock.patch.object(rbd_store.rbd.Image, 'write') as write:
+            write.side_effect = lambda data, offset: len(data)
+            ret = self.store.add('fake_image_id', six.BytesIO(data),
+                                 len(data), verifier=verifier)
+
+        self.assertEqual([0, 2 * units.Ki],
+                         [c[0][1] for c in write.call_args_list])
+        self.assertEqual(len(data), ret[1])
+        self.assertEqual(hashlib.md5(data).hexdigest(), ret[2])
+        self.assertEqual(3, verifier.update.call_count)
+
+    def test_add_thin_provisioning_disabled(self):
+        self.config(rbd_store_write_window=1, rbd_thin_provisioning=False)
+        self.store.configure()
+        self.store.chunk_size = units.Ki
+        self.store.WRITE_CHUNKSIZE = units.Ki
+        data = b'\0' * 2 * units.Ki
+        with mock.patch.object(rbd_store.rbd.Image, 'write') as write:
+            write.side_effect = lambda data, offset: len(data)
+            self.store.add('fake_image_id', six.BytesIO(data), len(data))
+
+        self.assertEqual(2, write.call_count)
+
     def test_add_duplicate_image(self):
 
         def _fake_create_image(*args, **kwargs):
@@ -298,6 +440,71 @@ class TestStore(base.StoreBaseTest,
         self.called_commands_expected = ['unprotect_snap', 'remove_snap',
                                          'remove']
 
+    def _delete_deferred(self, *image_names):
+        """Delete images in deferred mode, returning the purge function."""
+        self.config(rbd_store_deferred_delete=True,
+                    rbd_store_trash_purge_interval=0.5)
+        self.store.configure()
+        with mock.patch.object(MockRBD.Image, 'list_snaps') as list_snaps:
+            list_snaps.return_value = []
+            with mock.patch.object(MockRBD.Image, 'id', create=True) as id_:
+                id_.side_effect = ['id-%s' % name for name in image_names]
+                with mock.patch.object(rbd_store.eventlet,
+                                       'spawn_n') as spawn_n:
+                    for name in image_names:
+                        self.store._delete_image('fake_pool', name)
+
+        self.assertEqual(1, spawn_n.call_count)
+        return spawn_n.call_args[0][0]
+
+    @mock.patch.object(rbd_store.eventlet, 'sleep')
+    @mock.patch.object(rbd_store.tpool, 'execute')
+    @mock.patch.object(MockRBD.RBD, 'trash_remove', create=True)
+    @mock.patch.object(MockRBD.RBD, 'trash_move', create=True)
+    @mock.patch.object(MockRBD.RBD, 'remove')
+    def test_delete_image_deferred(self, remove, trash_move, trash_remove,
+                                   execute, sleep):
+        execute.side_effect = lambda func, *args: func(*args)
+        purge = self._delete_deferred('image1', 'image2')
+
+        self.assertFalse(remove.called)
+        self.assertEqual(['image1', 'image2'],
+                         [c[0][1] for c in trash_move.call_args_list])
+        self.assertFalse(trash_remove.called)
+
+        purge()
+        self.assertEqual(['id-image1', 'id-image2'],
+                         [c[0][1] for c in trash_remove.call_args_list])
+        self.assertEqual([mock.call(0.5)] * 2, sleep.call_args_list)
+
+        # Once the trash is purged, a new delete starts purging it again
+        self._delete_deferred('image3')
+
+    @mock.patch.object(rbd_store.eventlet, 'sleep')
+    @mock.patch.object(rbd_store.tpool, 'execute')
+    @mock.patch.object(MockRBD.RBD, 'trash_remove', create=True)
+    @mock.patch.object(MockRBD.RBD, 'trash_move', create=True)
+    def test_delete_image_deferred_purge_error(self, trash_move, trash_remove,
+                                               execute, sleep):
+        execute.side_effect = [MockRBD.ImageBusy(), None]
+        purge = self._delete_deferred('image1', 'image2')
+
+        with mock.patch.object(rbd_store.LOG, 'warning') as warning:
+            purge()
+        self.assertEqual(1, warning.call_count)
+        self.assertEqual(2, execute.call_count)
+
+    @mock.patch.object(MockRBD.RBD, 'trash_move', create=True)
+    def test_delete_image_deferred_w_snaps(self, trash_move):
+        self.config(rbd_store_deferred_delete=True)
+        self.store.configure()
+        with mock.patch.object(MockRBD.Image, 'list_snaps') as list_snaps:
+            list_snaps.return_value = [{'name': 'snap'}]
+            self.assertRaises(exceptions.HasSnapshot,
+                              self.store._delete_image,
+                              'fake_pool', self.location.image)
+        self.assertFalse(trash_move.called)
+
     def test_delete_image_w_snap_exc_image_busy(self):
         def _fake_unprotect_snap(*args, **kwargs):
             self.called_commands_actual.append('unprotect_snap')
@@ -325,11 +532,155 @@ class TestStore(base.StoreBaseTest,
 
             self.called_commands_expected = ['remove']
 
-    def test_get_partial_image(self):
+    def _get_image(self, offset=0, chunk_size=None):
+        """Get the image, read from a 10 byte RBD image in 2 byte chunks."""
+        self.store.READ_CHUNKSIZE = 2
         loc = Location('test_rbd_store', rbd_store.StoreLocation, self.conf,
                        store_specs=self.store_specs)
-        self.assertRaises(exceptions.StoreRandomGetNotSupported,
-                          self.store.get, loc, chunk_size=1)
+        with mock.patch.object(rbd_store.rbd.Image, 'stat',
+                               create=True) as stat:
+            stat.return_value = {'size': 10}
+            image_iter, size = self.store.get(loc, offset=offset,
+                                              chunk_size=chunk_size)
+            return list(image_iter), size
+
+    def _fake_aio_read(self, fail_offset=None):
+        """Return a fake aio_read recording the calls made to it."""
+        self.aio_calls = []
+
+        def _aio_read(offset, length, oncomplete):
+            self.aio_calls.append(('read', offset))
+            completion = mock.Mock()
+            ret = -5 if offset == fail_offset else length
+            completion.get_return_value.return_value = ret
+
+            def _wait():
+                self.aio_calls.append(('wait', offset))
+                data = None if ret < 0 else str(offset).encode() * length
+                oncomplete(completion, data)
+
+            completion.wait_for_complete_and_cb.side_effect = _wait
+            return completion
+        return _aio_read
+
+    def test_get_partial_image(self):
+        self.config(rbd_store_read_window=1)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'read') as read:
+            read.side_effect = lambda offset, length: b'*' * length
+            chunks, size = self._get_image(offset=3, chunk_size=5)
+
+        self.assertEqual(5, size)
+        self.assertEqual([b'**', b'**', b'*'], chunks)
+        self.assertEqual([mock.call(3, 2), mock.call(5, 2), mock.call(7, 1)],
+                         read.call_args_list)
+
+    def test_get_offset_past_end(self):
+        self.config(rbd_store_read_window=1)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'read') as read:
+            chunks, size = self._get_image(offset=12)
+
+        self.assertEqual(0, size)
+        self.assertEqual([], chunks)
+        self.assertFalse(read.called)
+
+    def test_get_read_ahead(self):
+        self.config(rbd_store_read_window=2)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'aio_read',
+                               create=True) as aio_read:
+            aio_read.side_effect = self._fake_aio_read()
+            chunks, size = self._get_image(offset=4)
+
+        self.assertEqual(6, size)
+        self.assertEqual([b'44', b'66', b'88'], chunks)
+        # No more than two reads are ever in flight
+        self.assertEqual([('read', 4), ('read', 6), ('wait', 4),
+                          ('read', 8), ('wait', 6), ('wait', 8)],
+                         self.aio_calls)
+
+    def test_get_read_ahead_error(self):
+        self.config(rbd_store_read_window=2)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'aio_read',
+                               create=True) as aio_read:
+            aio_read.side_effect = self._fake_aio_read(fail_offset=2)
+            self.assertRaises(exceptions.BackendException,
+                              self._get_image)
+
+        # The pending read is waited for before the image is closed
+        self.assertEqual([('read', 0), ('read', 2), ('wait', 0),
+                          ('read', 4), ('wait', 2), ('wait', 4)],
+                         self.aio_calls)
+
+    def _fake_diff_iterate(self, offset, length, from_snapshot, cb,
+                           whole_object=False):
+        # Bytes 2 to 5 of the image are allocated, bytes 8 to 9 are not
+        self.assertEqual((0, 10, None, True),
+                         (offset, length, from_snapshot, whole_object))
+        cb(2, 3, True)
+        cb(8, 2, False)
+
+    @mock.patch.object(MockRBD.Image, 'features',
+                       return_value=MockRBD.RBD_FEATURE_FAST_DIFF)
+    def test_get_sparse(self, features):
+        self.config(rbd_store_read_window=1)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'diff_iterate',
+                               create=True) as diff_iterate:
+            diff_iterate.side_effect = self._fake_diff_iterate
+            with mock.patch.object(rbd_store.rbd.Image, 'read') as read:
+                read.side_effect = lambda offset, length: b'*' * length
+                chunks, size = self._get_image()
+
+        self.assertEqual(10, size)
+        self.assertEqual([b'\0\0', b'**', b'**', b'\0\0', b'\0\0'], chunks)
+        self.assertEqual([mock.call(2, 2), mock.call(4, 2)],
+                         read.call_args_list)
+
+    @mock.patch.object(MockRBD.Image, 'features',
+                       return_value=MockRBD.RBD_FEATURE_FAST_DIFF)
+    def test_get_sparse_read_ahead(self, features):
+        self.config(rbd_store_read_window=2)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'diff_iterate',
+                               create=True) as diff_iterate:
+            diff_iterate.side_effect = self._fake_diff_iterate
+            with mock.patch.object(rbd_store.rbd.Image, 'aio_read',
+                                   create=True) as aio_read:
+                aio_read.side_effect = self._fake_aio_read()
+                chunks, size = self._get_image()
+
+        self.assertEqual([b'\0\0', b'22', b'44', b'\0\0', b'\0\0'], chunks)
+        self.assertEqual([('read', 2), ('read', 4), ('wait', 2),
+                          ('wait', 4)], self.aio_calls)
+
+    @mock.patch.object(MockRBD.Image, 'features',
+                       return_value=MockRBD.RBD_FEATURE_LAYERING)
+    def test_get_sparse_without_fast_diff(self, features):
+        self.config(rbd_store_read_window=1)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'diff_iterate',
+                               create=True) as diff_iterate:
+            with mock.patch.object(rbd_store.rbd.Image, 'read') as read:
+                read.side_effect = lambda offset, length: b'*' * length
+                chunks, size = self._get_image()
+
+        self.assertFalse(diff_iterate.called)
+        self.assertEqual(5, read.call_count)
+
+    def test_get_sparse_disabled(self):
+        self.config(rbd_store_read_window=1, rbd_store_sparse_read=False)
+        self.store.configure()
+        with mock.patch.object(rbd_store.rbd.Image, 'diff_iterate',
+                               create=True) as diff_iterate:
+            with mock.patch.object(rbd_store.rbd.Image, 'read') as read:
+                read.side_effect = lambda offset, length: b'*' * length
+                chunks, size = self._get_image()
+
+        self.assertFalse(diff_iterate.called)
+        self.assertEqual(5, read.call_count)
 
     @mock.patch.object(MockRados.Rados, 'connect')
     def test_rados_connect_timeout(self, mock_rados_connect):
@@ -348,6 +699,101 @@ class TestStore(base.StoreBaseTest,
                 pass
         self.assertRaises(exceptions.BackendException, test)
 
+    @mock.patch.object(MockRados.Rados, 'connect')
+    def test_connection_reused(self, mock_rados_connect):
+        with self.store.get_connection('conffile', 'rados_id') as conn:
+            with conn.open_ioctx('fake_pool') as ioctx:
+                pass
+        with self.store.get_connection('conffile', 'rados_id') as conn2:
+            with conn2.open_ioctx('fake_pool') as ioctx2:
+                pass
+        self.assertIs(conn, conn2)
+        self.assertIs(ioctx, ioctx2)
+        self.assertEqual(1, mock_rados_connect.call_count)
+
+        # Another user gets a connection of its own
+        with self.store.get_connection('conffile', 'other_id') as conn3:
+            self.assertIsNot(conn, conn3)
+        self.assertEqual(2, mock_rados_connect.call_count)
+
+    @mock.patch.object(MockRados.Rados, 'shutdown')
+    def test_connection_dropped_on_rados_error(self, mock_shutdown):
+        def test():
+            with self.store.get_connection('conffile', 'rados_id'):
+                raise MockRados.Error()
+        self.assertRaises(MockRados.Error, test)
+        mock_shutdown.assert_called_once_with()
+        self.assertIsNone(rbd_store.CONNECTION_POOL.get(
+            ('conffile', 'rados_id'), 300))
+
+    @mock.patch.object(MockRados.Rados, 'shutdown')
+    def test_connection_dropped_on_any_error(self, mock_shutdown):
+        def test():
+            with self.store.get_connection('conffile', 'rados_id'):
+                raise IOError()
+        self.assertRaises(IOError, test)
+        mock_shutdown.assert_called_once_with()
+        self.assertIsNone(rbd_store.CONNECTION_POOL.get(
+            ('conffile', 'rados_id'), 300))
+
+    @mock.patch.object(MockRados.Rados, 'shutdown')
+    def test_connection_kept_on_image_error(self, mock_shutdown):
+        for error in (MockRBD.ImageNotFound, MockRBD.ImageBusy,
+                      exceptions.NotFound):
+            def test():
+                with self.store.get_connection('conffile', 'rados_id'):
+                    raise error()
+            self.assertRaises(error, test)
+        self.assertFalse(mock_shutdown.called)
+        self.assertIsNotNone(rbd_store.CONNECTION_POOL.get(
+            ('conffile', 'rados_id'), 300))
+
+    @mock.patch.object(rbd_store, 'time')
+    @mock.patch.object(MockRados.Rados, 'shutdown')
+    def test_connection_pool_evicts_idle(self, mock_shutdown, mock_time):
+        self.config(rados_connection_pool_size=1,
+                    rados_connection_idle_timeout=60)
+        self.store.configure()
+        mock_time.time.return_value = 1000
+        with self.store.get_connection('conffile', 'rados_id') as conn:
+            with self.store.get_connection('conffile', 'rados_id') as conn2:
+                pass
+        # Only one idle connection is kept
+        self.assertEqual(1, mock_shutdown.call_count)
+
+        mock_time.time.return_value = 1060
+        with self.store.get_connection('conffile', 'rados_id') as conn3:
+            self.assertIsNot(conn, conn3)
+            self.assertIsNot(conn2, conn3)
+        self.assertEqual(2, mock_shutdown.call_count)
+
+    def test_connection_pool_unhealthy(self):
+        with self.store.get_connection('conffile', 'rados_id') as conn:
+            pass
+        conn.client.state = 'shutdown'
+        with self.store.get_connection('conffile', 'rados_id') as conn2:
+            self.assertIsNot(conn, conn2)
+
+    @mock.patch.object(rbd_store.os, 'getpid')
+    def test_connection_pool_after_fork(self, mock_getpid):
+        mock_getpid.return_value = 1
+        with self.store.get_connection('conffile', 'rados_id') as conn:
+            pass
+        mock_getpid.return_value = 2
+        with mock.patch.object(MockRados.Rados, 'shutdown') as shutdown:
+            with self.store.get_connection('conffile', 'rados_id') as conn2:
+                self.assertIsNot(conn, conn2)
+            self.assertFalse(shutdown.called)
+
+    @mock.patch.object(MockRados.Rados, 'connect')
+    def test_connection_pool_disabled(self, mock_rados_connect):
+        self.config(rados_connection_pool_size=0)
+        self.store.configure()
+        for i in range(2):
+            with self.store.get_connection('conffile', 'rados_id'):
+                pass
+        self.assertEqual(2, mock_rados_connect.call_count)
+
     def test_create_image_conf_features(self):
         # Tests that we use non-0 features from ceph.conf and cast to int.
         fsid = 'fake'
@@ -19,6 +19,7 @@ import hashlib
 import uuid
 import xml.etree.ElementTree
 
+import boto.exception
 import boto.s3.connection
 import mock
 from oslo_utils import units
@@ -69,6 +70,10 @@ class FakeKey(object):
     def exists(self):
         return self.bucket.exists(self.name)
 
+    def open_read(self):
+        if not self.exists():
+            raise boto.exception.S3ResponseError(404, 'Not Found')
+
     def delete(self):
         self.bucket.delete(self.name)
 
@@ -242,7 +247,7 @@ def fakers():
         if host.startswith('http://') or host.startswith('https://'):
             raise exceptions.UnsupportedBackend(host)
 
-    def fake_get_bucket(bucket_id):
+    def fake_get_bucket(bucket_id, validate=True):
         bucket = fixture_buckets.get(bucket_id)
         if not bucket:
             bucket = FakeBucket(bucket_id)
@@ -314,6 +319,62 @@ class TestStore(base.StoreBaseTest,
         self.assertRaises(exceptions.StoreRandomGetNotSupported,
                           self.store.get, loc, chunk_size=1)
 
+    def test_get_skips_bucket_and_key_lookups(self):
+        """Test that get() goes straight to the GET of the object."""
+        loc = location.get_location_from_uri(
+            "s3://user:key@auth_address/glance/%s" % FAKE_UUID,
+            conf=self.conf)
+        with mock.patch.object(FakeBucket, 'exists') as exists:
+            exists.return_value = True
+            (image_s3, image_size) = self.store.get(loc)
+            self.assertEqual(FIVE_KB, image_size)
+            # Only the GET itself (open_read) checks the key
+            self.assertEqual(1, exists.call_count)
+        boto.s3.connection.S3Connection.get_bucket.assert_called_with(
+            'glance', validate=False)
+
+    def test_get_size(self):
+        """Test that we can get the size of an object in the s3 store."""
+        loc = location.get_location_from_uri(
+            "s3://user:key@auth_address/glance/%s" % FAKE_UUID,
+            conf=self.conf)
+        self.assertEqual(FIVE_KB, self.store.get_size(loc))
+
+    def test_get_size_non_existing(self):
+        uri = "s3://user:key@auth_address/glance/noexist"
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        self.assertEqual(0, self.store.get_size(loc))
+
+    def test_get_size_cached(self):
+        """Test that repeated get_size calls reuse the HEAD result."""
+        loc = location.get_location_from_uri(
+            "s3://user:key@auth_address/glance/%s" % FAKE_UUID,
+            conf=self.conf)
+        get_bucket = boto.s3.connection.S3Connection.get_bucket
+        self.assertEqual(FIVE_KB, self.store.get_size(loc))
+        calls = get_bucket.call_count
+        self.assertEqual(FIVE_KB, self.store.get_size(loc))
+        self.assertEqual(calls, get_bucket.call_count)
+
+    def test_get_size_cache_disabled(self):
+        self.config(s3_store_head_cache_ttl=0)
+        self.store.configure()
+        loc = location.get_location_from_uri(
+            "s3://user:key@auth_address/glance/%s" % FAKE_UUID,
+            conf=self.conf)
+        get_bucket = boto.s3.connection.S3Connection.get_bucket
+        self.assertEqual(FIVE_KB, self.store.get_size(loc))
+        calls = get_bucket.call_count
+        self.assertEqual(FIVE_KB, self.store.get_size(loc))
+        self.assertEqual(calls + 1, get_bucket.call_count)
+
+    def test_get_size_cache_invalidated_on_delete(self):
+        uri = "s3://user:key@auth_address/glance/%s" % FAKE_UUID
+        loc = location.get_location_from_uri(uri, conf=self.conf)
+        self.assertEqual(FIVE_KB, self.store.get_size(loc))
+        self.store.delete(loc)
+        self.assertEqual(0, self.store.get_size(loc))
+
     def test_get_calling_format_path(self):
         """Test a "normal" retrieval of an image in chunks."""
         self.config(s3_store_bucket_url_format='path')
@@ -119,6 +119,101 @@ class TestStore(base.StoreBaseTest,
         chunks = [c for c in image_file]
         self.assertEqual(expected_returns, chunks)
 
+    def _get_loc(self):
+        return location.get_location_from_uri(
+            "vsphere://127.0.0.1/folder/openstack_glance/%s"
+            "?dsName=ds1&dcPath=dc1" % FAKE_UUID, conf=self.conf)
+
+    def test_get_partial(self):
+        loc = self._get_loc()
+        with mock.patch('requests.Session.request') as HttpConn:
+            HttpConn.return_value = utils.fake_response(
+                status_code=206, headers={'content-length': 5},
+                content='am a ')
+            (image_file, image_size) = self.store.get(loc, offset=2,
+                                                      chunk_size=5)
+            self.assertEqual(5, image_size)
+            self.assertEqual('am a ', ''.join(image_file))
+        headers = HttpConn.call_args[1]['headers']
+        self.assertEqual('bytes=2-6', headers['Range'])
+        self.assertIn('Cookie', headers)
+
+    def test_get_partial_range_ignored(self):
+        loc = self._get_loc()
+        with mock.patch('requests.Session.request') as HttpConn:
+            HttpConn.return_value = utils.fake_response()
+            (image_file, image_size) = self.store.get(loc, offset=28)
+            self.assertEqual(3, image_size)
+            self.assertEqual(['ut\n'], list(image_file))
+
+    def _broken_response(self, chunks):
+        """Return a response whose body is cut short by a reset."""
+        response = utils.fake_response()
+        response.raw.read = mock.Mock(
+            side_effect=chunks + [IOError('Connection reset by peer')])
+        return response
+
+    def test_get_resumed(self):
+        loc = self._get_loc()
+        with mock.patch('requests.Session.request') as HttpConn:
+            HttpConn.side_effect = [
+                self._broken_response(['I am a teapot']),
+                utils.fake_response(status_code=206,
+                                    headers={'content-length': 18},
+                                    content=', short and stout\n')]
+            (image_file, image_size) = self.store.get(loc)
+            self.assertEqual('I am a teapot, short and stout\n',
+                             ''.join(image_file))
+        self.assertEqual('bytes=13-30',
+                         HttpConn.call_args[1]['headers']['Range'])
+
+    def test_get_resumed_range_ignored(self):
+        loc = self._get_loc()
+        with mock.patch('requests.Session.request') as HttpConn:
+            HttpConn.side_effect = [self._broken_response(['I am a teapot']),
+                                    utils.fake_response()]
+            (image_file, image_size) = self.store.get(loc)
+            self.assertEqual('I am a teapot, short and stout\n',
+                             ''.join(image_file))
+
+    def test_get_resumed_after_server_error(self):
+        loc = self._get_loc()
+        with mock.patch('requests.Session.request') as HttpConn:
+            HttpConn.side_effect = [
+                self._broken_response(['I am a teapot']),
+                utils.fake_response(status_code=503),
+                utils.fake_response(status_code=206,
+                                    headers={'content-length': 18},
+                                    content=', short and stout\n')]
+            (image_file, image_size) = self.store.get(loc)
+            self.assertEqual('I am a teapot, short and stout\n',
+                             ''.join(image_file))
+        self.assertEqual(3, HttpConn.call_count)
+
+    def test_get_resumed_file_changed(self):
+        loc = self._get_loc()
+        with mock.patch('requests.Session.request') as HttpConn:
+            first = self._broken_response(['I am a teapot'])
+            first.headers['etag'] = '"teapot"'
+            HttpConn.side_effect = [
+                first,
+                utils.fake_response(status_code=206,
+                                    headers={'content-length': 18,
+                                             'etag': '"kettle"'},
+                                    content=', short and stout\n')]
+            (image_file, image_size) = self.store.get(loc)
+            self.assertRaises(exceptions.BackendException, list, image_file)
+
+    def test_get_retries_exhausted(self):
+        self.store.api_retry_count = 1
+        loc = self._get_loc()
+        with mock.patch('requests.Session.request') as HttpConn:
+            HttpConn.side_effect = [self._broken_response(['I am']),
+                                    self._broken_response([' a'])]
+            (image_file, image_size) = self.store.get(loc)
+            self.assertRaises(exceptions.BackendException, list, image_file)
+        self.assertEqual(2, HttpConn.call_count)
+
     @mock.patch('oslo_vmware.api.VMwareAPISession')
     def test_get_non_existing(self, mock_api_session):
         """
@@ -306,6 +401,21 @@ class TestStore(base.StoreBaseTest,
         reader.read()
         verifier.update.assert_called_with(content)
 
+    def test_buffered_reader(self):
+        content = b'0123456789'
+        image = mock.Mock(wraps=six.BytesIO(content))
+        reader = vm_store._BufferedReader(image, 4)
+        chunks = [reader.read(3) for i in range(5)]
+        self.assertEqual([b'012', b'3', b'456', b'7', b'89'], chunks)
+        self.assertEqual(b'', reader.read(3))
+        self.assertEqual([mock.call(4), mock.call(4), mock.call(4),
+                          mock.call(4)], image.read.call_args_list)
+
+    def test_buffered_reader_read_all(self):
+        reader = vm_store._BufferedReader(six.BytesIO(b'0123456789'), 4)
+        self.assertEqual(b'0', reader.read(1))
+        self.assertEqual(b'123456789', reader.read())
+
     def test_sanity_check_api_retry_count(self):
         """Test that sanity check raises if api_retry_count is <= 0."""
         self.store.conf.glance_store.vmware_api_retry_count = -1
@@ -435,6 +545,49 @@ class TestStore(base.StoreBaseTest,
         self.store._build_vim_cookie_header()
         self.assertFalse(mock_api_session.called)
 
+    @mock.patch.object(vm_store, 'time')
+    def test_build_vim_cookie_header_recently_checked(self, mock_time):
+        self.config(vmware_session_check_interval=60, group='glance_store')
+        self.store.session.is_current_session_active = mock.Mock()
+        self.store.session.is_current_session_active.return_value = True
+        mock_time.time.return_value = 1000
+        self.store._build_vim_cookie_header(True)
+        mock_time.time.return_value = 1059
+        self.store._build_vim_cookie_header(True)
+        self.assertEqual(
+            1, self.store.session.is_current_session_active.call_count)
+
+        mock_time.time.return_value = 1060
+        self.store._build_vim_cookie_header(True)
+        self.assertEqual(
+            2, self.store.session.is_current_session_active.call_count)
+
+    def test_build_vim_cookie_header_check_interval_disabled(self):
+        self.config(vmware_session_check_interval=0, group='glance_store')
+        self.store.session.is_current_session_active = mock.Mock()
+        self.store.session.is_current_session_active.return_value = True
+        self.store._build_vim_cookie_header(True)
+        self.store._build_vim_cookie_header(True)
+        self.assertEqual(
+            2, self.store.session.is_current_session_active.call_count)
+
+    @mock.patch.object(vm_store.Store, 'select_datastore')
+    @mock.patch.object(vm_store, 'new_session')
+    def test_add_reuses_http_session(self, mock_new_session,
+                                     mock_select_datastore):
+        self.config(vmware_upload_chunk_size=2, group='glance_store')
+        mock_select_datastore.return_value = self.store.datastores[0][0]
+        with mock.patch('requests.Session.request') as HttpConn:
+            HttpConn.return_value = utils.fake_response()
+            for i in range(2):
+                image = six.BytesIO(b"*" * FIVE_KB)
+                self.store.add(str(uuid.uuid4()), image, FIVE_KB)
+        self.assertFalse(mock_new_session.called)
+        self.assertEqual(2, HttpConn.call_count)
+        data = HttpConn.call_args[1]['data']
+        self.assertIsInstance(data, vm_store._BufferedReader)
+        self.assertEqual(2 * units.Ki, data.chunk_size)
+
     @mock.patch.object(vm_store.Store, 'select_datastore')
     @mock.patch.object(api, 'VMwareAPISession')
     def test_add_ioerror(self, mock_api_session, mock_select_datastore):
@@ -556,6 +709,86 @@ class TestStore(base.StoreBaseTest,
         self.assertEqual('c', ds.datacenter.path)
         self.assertEqual('d', ds.name)
 
+    def _build_cached_datastores(self, datastores):
+        with mock.patch.object(vm_store.Store, '_get_datastore') as get_ds:
+            get_ds.side_effect = fake_datastore_obj
+            self.store.datastores = (
+                self.store._build_datastore_weighted_map(datastores))
+
+    @mock.patch.object(vm_store, 'time')
+    @mock.patch.object(vm_store.Store, '_get_freespace')
+    def test_select_datastore_cached_freespace(self, mock_get_freespace,
+                                               mock_time):
+        self._build_cached_datastores(['a:b:100', 'c:d:100'])
+        mock_get_freespace.side_effect = [100, 200]
+        mock_time.time.return_value = 1000
+
+        ds = self.store.select_datastore(10)
+        self.assertEqual('d', ds.name)
+        mock_time.time.return_value = 1059
+        ds = self.store.select_datastore(10)
+        self.assertEqual('d', ds.name)
+        self.assertEqual(2, mock_get_freespace.call_count)
+
+    @mock.patch.object(vm_store, 'eventlet')
+    @mock.patch.object(vm_store, 'time')
+    @mock.patch.object(vm_store.Store, '_get_freespace')
+    def test_select_datastore_stale_freespace(self, mock_get_freespace,
+                                              mock_time, mock_eventlet):
+        self._build_cached_datastores(['a:b:100'])
+        mock_get_freespace.side_effect = [100, 50]
+        mock_time.time.return_value = 1000
+        self.store.select_datastore(10)
+
+        # The stale value is used while it is refreshed in the background
+        mock_time.time.return_value = 1060
+        ds = self.store.select_datastore(10)
+        self.assertEqual(100, ds.freespace)
+        self.store.select_datastore(10)
+        mock_eventlet.spawn_n.assert_called_once_with(
+            self.store._refresh_freespace, ds)
+
+        self.store._refresh_freespace(ds)
+        self.assertEqual(50, self.store.select_datastore(10).freespace)
+        self.assertEqual(set(), self.store._refreshing)
+
+    @mock.patch.object(vm_store.Store, '_get_freespace')
+    def test_select_datastore_nearly_full(self, mock_get_freespace):
+        self._build_cached_datastores(['a:b:100'])
+        mock_get_freespace.side_effect = [100, 80]
+        self.store.select_datastore(10)
+
+        # The image would nearly fill the cached free space, so the
+        # datastore is queried before it is selected.
+        self.assertRaises(exceptions.StorageFull,
+                          self.store.select_datastore, 95)
+        self.assertEqual(2, mock_get_freespace.call_count)
+
+    @mock.patch.object(vm_store.Store, '_get_freespace')
+    def test_select_datastore_reserved_freespace(self, mock_get_freespace):
+        self._build_cached_datastores(['a:b:100', 'c:d:100'])
+        mock_get_freespace.side_effect = [100, 90]
+        ds = self.store.select_datastore(10)
+        self.assertEqual('b', ds.name)
+
+        self.store._reserve_freespace(ds, 20)
+        self.assertEqual('d', self.store.select_datastore(10).name)
+        self.store._release_freespace(ds, 20)
+        self.assertEqual('b', self.store.select_datastore(10).name)
+        self.store._consume_freespace(ds, 20)
+        self.assertEqual('d', self.store.select_datastore(10).name)
+        self.assertEqual({}, self.store._reservations)
+
+    @mock.patch.object(vm_store.Store, '_get_freespace')
+    def test_select_datastore_freespace_cache_disabled(self,
+                                                       mock_get_freespace):
+        self.config(vmware_freespace_cache_ttl=0, group='glance_store')
+        self._build_cached_datastores(['a:b:100'])
+        mock_get_freespace.return_value = 100
+        self.store.select_datastore(10)
+        self.store.select_datastore(10)
+        self.assertEqual(2, mock_get_freespace.call_count)
+
     def test_select_datastore_empty_list(self):
         datastores = []
         self.store.datastores = (